@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+
+import db
+from configs.globals import ALLOWLIST_REFRESH_INTERVAL, FILTER_PATH, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Bumped whenever tracked_repos changes so every process reloads its copy
+ALLOWLIST_VERSION_KEY = 'tracked_repos_version'
+
+
+def normalize(repo):
+    # GitHub treats owner/name case-insensitively
+    return repo.strip().lower()
+
+
+class RepoAllowlist:
+    # Repos whose PRs count towards the event, keyed by full owner/name.
+    # Membership comes from the filter file plus the tracked_repos table,
+    # which also carries per-repo config (points weight, active window).
+    # Both sources are re-read only when the file's mtime or the table's
+    # version changes, and that check runs at most once per refresh_interval.
+
+    def __init__(self, path=FILTER_PATH, refresh_interval=ALLOWLIST_REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._repos = {}
+        self._key = None
+        self._checked_at = 0
+
+    def _current_key(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with db.pool.connection() as client:
+            row = client.execute("SELECT value FROM app_state WHERE key = ?", (ALLOWLIST_VERSION_KEY,)).fetchone()
+        return mtime, row[0] if row else 0
+
+    def _load(self):
+        repos = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        repos[normalize(line)] = {
+                            'repo_name': line.strip(), 'weight': 1.0, 'active_from': None, 'active_until': None,
+                        }
+        except FileNotFoundError:
+            logging.warning(f"Filter list {self.path} not found.")
+
+        with db.pool.connection() as client:
+            for repo_name, weight, active_from, active_until in client.execute(
+                "SELECT repo_name, weight, active_from, active_until FROM tracked_repos"
+            ):
+                repos[normalize(repo_name)] = {
+                    'repo_name': repo_name, 'weight': weight, 'active_from': active_from, 'active_until': active_until,
+                }
+        return repos
+
+    def _refresh(self, force=False):
+        if not force and time.time() - self._checked_at < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and time.time() - self._checked_at < self.refresh_interval:
+                return
+            # The key is read before loading, so a change that lands in
+            # between is picked up on the next check instead of being lost
+            key = self._current_key()
+            if key != self._key:
+                self._repos = self._load()
+                self._key = key
+                logging.info(f"Loaded {len(self._repos)} tracked repos.")
+            self._checked_at = time.time()
+
+    def version(self):
+        self._refresh()
+        return self._key
+
+    def get(self, repo):
+        self._refresh()
+        return self._repos.get(normalize(repo))
+
+    def is_tracked(self, repo, at=None):
+        config = self.get(repo)
+        if config is None:
+            return False
+        at = time.time() if at is None else at
+        if config['active_from'] is not None and at < config['active_from']:
+            return False
+        if config['active_until'] is not None and at >= config['active_until']:
+            return False
+        return True
+
+    def repos(self, active_only=True):
+        self._refresh()
+        now = time.time()
+        return [
+            config['repo_name'] for config in self._repos.values()
+            if not active_only or self.is_tracked(config['repo_name'], now)
+        ]
+
+
+allowlist = RepoAllowlist()
+
+
+def set_repo_config(client, repo_name, weight=1.0, active_from=None, active_until=None):
+    client.execute("""
+    INSERT INTO tracked_repos (repo_name, weight, active_from, active_until)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(repo_name) DO UPDATE SET
+    weight = excluded.weight,
+    active_from = excluded.active_from,
+    active_until = excluded.active_until
+    """, (repo_name, weight, active_from, active_until))
+    _bump_version(client)
+    client.commit()
+
+
+def remove_repo_config(client, repo_name):
+    client.execute("DELETE FROM tracked_repos WHERE repo_name = ?", (repo_name,))
+    _bump_version(client)
+    client.commit()
+
+
+def _bump_version(client):
+    client.execute("""
+    INSERT INTO app_state (key, value) VALUES (?, 1)
+    ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """, (ALLOWLIST_VERSION_KEY,))
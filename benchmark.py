@@ -0,0 +1,321 @@
+# Synthetic load benchmark for the web endpoints, the leaderboard recompute
+# and the cron ingestion. Runs against a throwaway SQLite database and a
+# local stub of the GitHub REST API, and prints JSON so runs can be diffed:
+#
+#   python benchmark.py --users 1000 --prs 100000 --output bench.json
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from fake_github import FakeGitHub
+
+STATUSES = ['open', 'closed', 'merged']
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples, elapsed, errors=0):
+    latencies = [sample * 1000 for sample in samples]
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies) if latencies else None,
+        'throughput_rps': len(samples) / elapsed if elapsed else None,
+        'elapsed_s': elapsed,
+    }
+
+
+def synthetic_prs(rng, repos, logins, per_repo, first_id):
+    prs_by_repo = {}
+    pr_id = first_id
+    for repo in repos:
+        prs = []
+        for number in range(1, per_repo + 1):
+            pr_id += 1
+            merged = rng.random() < 0.3
+            prs.append({
+                'id': pr_id,
+                'number': number,
+                'state': 'closed' if merged else 'open',
+                'user': {'login': rng.choice(logins)},
+                'updated_at': f"2026-01-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z",
+                '_details': {
+                    'commits': rng.randint(1, 20),
+                    'additions': rng.randint(1, 500),
+                    'deletions': rng.randint(0, 200),
+                    'state': 'closed' if merged else 'open',
+                    'merged': merged,
+                },
+            })
+        prs_by_repo[repo] = prs
+    return prs_by_repo
+
+
+def seed(db, leaderboard, rng, users, prs, repos):
+    logins = [f"bench-user-{i}" for i in range(users)]
+    with db.pool.connection() as client:
+        client.executemany("""
+        INSERT OR IGNORE INTO users (github_user, name, email, contact, avatar, link)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, [(login, f"Bench User {i}", f"{i}@example.com", '0000000000', '', '') for i, login in enumerate(logins)])
+        client.executemany("""
+        INSERT OR IGNORE INTO pull_requests (pr_id, repo_name, github_login, total_commits, total_lines, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            (pr_id, rng.choice(repos), rng.choice(logins), rng.randint(1, 20), rng.randint(-100, 500), rng.choice(STATUSES))
+            for pr_id in range(1, prs + 1)
+        ])
+        client.commit()
+
+        # The chunked shadow rebuild reconcile and rescore.py run, pauses
+        # between chunks included
+        started = time.perf_counter()
+        leaderboard.rebuild_leaderboard(client)
+        recompute = time.perf_counter() - started
+    return logins, recompute
+
+
+def hammer(app, paths, total, concurrency, login_for=None):
+    # Each thread gets its own test client; paths are picked round-robin
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        client = app.test_client()
+        local = []
+        local_errors = 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            path = paths[i % len(paths)]
+            if login_for:
+                with client.session_transaction() as session:
+                    session['github_id'] = login_for(i)
+            started = time.perf_counter()
+            response = client.get(path)
+            local.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                local_errors += 1
+        with lock:
+            samples.extend(local)
+            errors[0] += local_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - started, errors[0])
+
+
+def replay_webhooks(app, db, payloads, concurrency, secret=None):
+    # Signed like GitHub does when the app has a WEBHOOK_SECRET
+    samples = []
+    errors = [0]
+    ignored = [0]
+    lock = threading.Lock()
+    queue = list(payloads)
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                if not queue:
+                    return
+                payload = queue.pop()
+            body = json.dumps(payload).encode('utf-8')
+            headers = {'X-GitHub-Event': 'pull_request', 'Content-Type': 'application/json'}
+            if secret:
+                headers['X-Hub-Signature-256'] = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+            started = time.perf_counter()
+            response = client.post('/webhook', data=body, headers=headers)
+            elapsed = time.perf_counter() - started
+            with lock:
+                samples.append(elapsed)
+                if response.status_code >= 400:
+                    errors[0] += 1
+                elif (response.get_json(silent=True) or {}).get('status') == 'ignored':
+                    ignored[0] += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - started
+    result = summarize(samples, accepted, errors[0])
+    result['ignored'] = ignored[0]
+
+    # Time until the background worker has applied everything that was queued
+    with db.pool.connection() as client:
+        while client.execute("SELECT COUNT(*) FROM webhook_outbox").fetchone()[0]:
+            time.sleep(0.05)
+    result['drained_after_s'] = time.perf_counter() - started
+    return result
+
+
+def synthetic_webhooks(rng, db, count):
+    # Deliveries target a small set of existing PRs, so repeated events for
+    # the same PR coalesce the way a burst of synchronize events would.
+    with db.pool.connection() as client:
+        targets = client.execute("""
+        SELECT pr_id, repo_name, github_login FROM pull_requests
+        ORDER BY pr_id LIMIT ?
+        """, (max(1, count // 10),)).fetchall()
+
+    payloads = []
+    for _ in range(count):
+        pr_id, repo, github_login = rng.choice(targets)
+        merged = rng.random() < 0.3
+        payloads.append({
+            'action': rng.choice(['opened', 'synchronize', 'closed']),
+            'repository': {'full_name': repo},
+            'pull_request': {
+                'id': pr_id,
+                'user': {'login': github_login},
+                'commits': rng.randint(1, 20),
+                'additions': rng.randint(1, 500),
+                'deletions': rng.randint(0, 200),
+                'merged': merged,
+                'state': 'closed' if merged else 'open',
+            },
+        })
+    return payloads
+
+
+def load_payloads(path):
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_ingestion(db, utils, prs_by_repo):
+    results = {}
+    with db.pool.connection() as client:
+        for label in ('cold', 'warm'):
+            started = time.perf_counter()
+            synced = utils.fetch_filtered_prs(client)
+            results[label] = {'elapsed_s': time.perf_counter() - started, 'prs_synced': synced}
+    results['listed_prs'] = sum(len(prs) for prs in prs_by_repo.values())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PullRanker against synthetic load.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--prs', type=int, default=100000)
+    parser.add_argument('--repos', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000, help="requests per read endpoint")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--webhooks', type=int, default=2000)
+    parser.add_argument('--webhook-payloads', help="JSONL file of recorded webhook payloads to replay")
+    parser.add_argument('--ingest-prs', type=int, default=200, help="PRs per repo served by the fake GitHub")
+    parser.add_argument('--ingest-repos', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db', help="SQLite path (defaults to a temporary file)")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='pullranker-bench-')
+    repos = [f"bench-org/repo-{i}" for i in range(args.repos)]
+    ingest_repos = [f"bench-org/ingest-{i}" for i in range(args.ingest_repos)]
+
+    # Recorded payloads' repos are tracked too, or every replay would only
+    # exercise the ignored fast path
+    payloads = load_payloads(args.webhook_payloads) if args.webhook_payloads else None
+    replayed_repos = sorted({
+        payload['repository']['full_name'] for payload in payloads or [] if payload.get('repository')
+    } - set(repos))
+
+    filter_path = os.path.join(workdir, 'filter.txt')
+    with open(filter_path, 'w') as f:
+        f.write('\n'.join(repos + ingest_repos + replayed_repos) + '\n')
+
+    # Everything below reads its configuration at import time
+    fake = FakeGitHub({})
+    os.environ['SQLITE_DB_PATH'] = args.db or os.path.join(workdir, 'bench.db')
+    os.environ['FILTER_PATH'] = filter_path
+    os.environ['GITHUB_API_URL'] = fake.url
+    os.environ['CRON_TOKEN'] = 'bench-token'
+    os.environ.setdefault('SQLITE_POOL_SIZE', str(max(8, args.concurrency)))
+
+    import db
+    import leaderboard
+    from configs.globals import WEBHOOK_SECRET
+    import main as web
+    import utils
+    logging.disable(logging.INFO)
+
+    report = {
+        'config': vars(args),
+        'python': sys.version.split()[0],
+    }
+
+    # Runs the migrations, as gunicorn's preload would
+    app = web.create_app()
+    logins, recompute = seed(db, leaderboard, rng, args.users, args.prs, repos)
+    report['leaderboard_recompute_s'] = recompute
+
+    report['endpoints'] = {}
+    report['endpoints']['GET /leaderboard'] = hammer(app, ['/leaderboard'], args.requests, args.concurrency)
+    report['endpoints']['GET /leaderboard/top'] = hammer(app, ['/leaderboard/top?limit=25'], args.requests, args.concurrency)
+    report['endpoints']['GET /leaderboard/around'] = hammer(
+        app, [f"/leaderboard/around/{login}" for login in logins[:200]], args.requests, args.concurrency
+    )
+    report['endpoints']['GET /dashboard'] = hammer(
+        app, ['/dashboard'], args.requests, args.concurrency, login_for=lambda i: logins[i % len(logins)]
+    )
+    report['endpoints']['GET /api/user/<id>/prs'] = hammer(
+        app, [f"/api/user/{login}/prs?limit=50" for login in logins[:200]], args.requests, args.concurrency
+    )
+
+    if payloads is None:
+        payloads = synthetic_webhooks(rng, db, args.webhooks)
+    report['endpoints']['POST /webhook'] = replay_webhooks(app, db, payloads, args.concurrency, WEBHOOK_SECRET)
+
+    fake.prs_by_repo = synthetic_prs(rng, ingest_repos, logins, args.ingest_prs, args.prs + 1000000)
+    fake.start()
+    try:
+        report['ingestion'] = run_ingestion(db, utils, fake.prs_by_repo)
+    finally:
+        fake.stop()
+    report['ingestion']['github_requests'] = fake.requests
+    report['ingestion']['github_not_modified'] = fake.not_modified
+
+    with db.pool.connection() as client:
+        started = time.perf_counter()
+        report['leaderboard_drift_rows'] = leaderboard.reconcile_leaderboard(client)
+        report['leaderboard_reconcile_s'] = time.perf_counter() - started
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
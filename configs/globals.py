@@ -3,4 +3,96 @@ import os
 
 load_dotenv()
 
-CRON_TOKEN = os.getenv('CRON_TOKEN')
\ No newline at end of file
+CRON_TOKEN = os.getenv('CRON_TOKEN')
+
+# Repos (owner/name, one per line) whose PRs count towards the event
+FILTER_PATH = os.getenv('FILTER_PATH', 'filter.txt')
+# Optional JSON overriding the default scoring rules; see scoring.py
+SCORING_PATH = os.getenv('SCORING_PATH', 'scoring.json')
+# Seconds between checks of filter.txt and tracked_repos for changes
+ALLOWLIST_REFRESH_INTERVAL = float(os.getenv('ALLOWLIST_REFRESH_INTERVAL', 5))
+
+# Point this at a local stub to run ingestion without hitting GitHub
+GITHUB_API_URL = os.getenv('GITHUB_API_URL', 'https://api.github.com').rstrip('/')
+GITHUB_TIMEOUT = float(os.getenv('GITHUB_TIMEOUT', 10))
+
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 8))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 50))
+
+# Longest the token pool will block waiting for a rate limit window to reset
+GITHUB_MAX_RATE_WAIT = float(os.getenv('GITHUB_MAX_RATE_WAIT', 3600))
+
+# Shared secret configured on the GitHub webhook; unset disables verification
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# How long a delivery ID is remembered for deduplicating redeliveries
+WEBHOOK_DELIVERY_TTL = float(os.getenv('WEBHOOK_DELIVERY_TTL', 3 * 24 * 3600))
+# Cached GitHub responses not revalidated for this long are pruned, e.g.
+# PRs or repos that dropped out of the sync
+HTTP_CACHE_TTL = float(os.getenv('HTTP_CACHE_TTL', 14 * 24 * 3600))
+
+# Total time the OAuth callback may spend talking to GitHub
+OAUTH_TIMEOUT = float(os.getenv('OAUTH_TIMEOUT', 5))
+
+# Webhook outbox draining
+WEBHOOK_BATCH_SIZE = int(os.getenv('WEBHOOK_BATCH_SIZE', 200))
+WEBHOOK_POLL_INTERVAL = float(os.getenv('WEBHOOK_POLL_INTERVAL', 5))
+# Short pause after a wakeup so a burst of deliveries drains as one batch
+WEBHOOK_DEBOUNCE = float(os.getenv('WEBHOOK_DEBOUNCE', 0.2))
+
+# Number of users whose serialized /dashboard response is kept in memory
+DASHBOARD_CACHE_SIZE = int(os.getenv('DASHBOARD_CACHE_SIZE', 2048))
+
+# /leaderboard/stream: how often each web worker checks for changes, the
+# keep-alive comment interval, how many past events are kept for resuming
+# clients, and per-client and per-worker limits
+STREAM_POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL', 1))
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15))
+STREAM_HISTORY = int(os.getenv('STREAM_HISTORY', 256))
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', 64))
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', 1000))
+# Threads of a gthread worker that open streams may never take, so ordinary
+# requests and webhooks always have one
+STREAM_RESERVED_THREADS = int(os.getenv('STREAM_RESERVED_THREADS', 2))
+
+# Page sizes for /api/user/<github_id>/prs
+USER_PRS_DEFAULT_LIMIT = int(os.getenv('USER_PRS_DEFAULT_LIMIT', 10))
+USER_PRS_MAX_LIMIT = int(os.getenv('USER_PRS_MAX_LIMIT', 100))
+
+# Window sizes for the ranked leaderboard views
+LEADERBOARD_TOP_DEFAULT = int(os.getenv('LEADERBOARD_TOP_DEFAULT', 10))
+LEADERBOARD_TOP_MAX = int(os.getenv('LEADERBOARD_TOP_MAX', 100))
+LEADERBOARD_RADIUS_DEFAULT = int(os.getenv('LEADERBOARD_RADIUS_DEFAULT', 5))
+LEADERBOARD_RADIUS_MAX = int(os.getenv('LEADERBOARD_RADIUS_MAX', 50))
+# Longest window accepted by /leaderboard?window=<days>d and /leaderboard/changes
+LEADERBOARD_WINDOW_MAX_DAYS = int(os.getenv('LEADERBOARD_WINDOW_MAX_DAYS', 365))
+
+# Root log level; DEBUG also logs per-request details
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Exposes /metrics in Prometheus text format. When off, no timing hooks or
+# instrumented connections are installed at all.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Bearer token a scraper must send for /metrics; unset hides the endpoint
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Seconds between each process publishing its metrics for the others to merge
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 15))
+
+# Per-repo polling intervals for the cron worker, in seconds
+SCHEDULER_DEFAULT_INTERVAL = float(os.getenv('SCHEDULER_DEFAULT_INTERVAL', 45 * 60))
+SCHEDULER_MIN_INTERVAL = float(os.getenv('SCHEDULER_MIN_INTERVAL', 5 * 60))
+SCHEDULER_MAX_INTERVAL = float(os.getenv('SCHEDULER_MAX_INTERVAL', 3 * 3600))
+# A repo that received webhooks this recently is not polled
+SCHEDULER_WEBHOOK_GRACE = float(os.getenv('SCHEDULER_WEBHOOK_GRACE', 15 * 60))
+# How often the cron worker checks the leaderboard for drift
+RECONCILE_INTERVAL = float(os.getenv('RECONCILE_INTERVAL', 45 * 60))
+# Users scored per transaction by a full leaderboard rebuild, and the pause
+# between chunks that lets webhook writes take the lock
+REBUILD_CHUNK_SIZE = int(os.getenv('REBUILD_CHUNK_SIZE', 500))
+REBUILD_PAUSE = float(os.getenv('REBUILD_PAUSE', 0.05))
+
+# Bearer token for the organiser import/export endpoints; unset disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# Most users a single bulk import may carry
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', 20000))
+# Rows fetched from SQLite per step of a streamed export
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 500))
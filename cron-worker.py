@@ -1,7 +1,15 @@
 import time
-from db import connect_db
-from utils import fetch_filtered_prs, update_leaderboard
+from db import connect_db, setup_database
+from utils import fetch_filtered_prs
+from leaderboard import reconcile_leaderboard
+from webhooks import drain_webhook_outbox
+from allowlist import allowlist
+from scheduler import due_repos, next_wakeup, record_polls, watermarks
+from scoring import rules as scoring_rules
 import logging
+import github
+from configs.globals import LOG_LEVEL, RECONCILE_INTERVAL, SCHEDULER_MIN_INTERVAL
+from metrics import flush as flush_metrics, record_shared, retire as retire_metrics
 import datetime
 import signal
 import sys
@@ -12,46 +20,108 @@ load_dotenv()
 
 os.getenv('CRON_TOKEN')
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 
 
-RUNNING = True  # Global flag for graceful shutdown
+# Set on SIGTERM/SIGINT. Shared with github.py, so GitHub token waits and
+# the ingestion in progress end early too, not just the sleep between cycles.
+STOP = github.STOP
+
+# Scoring rules the last reconcile ran with; a change triggers a recompute
+APPLIED_RULES = {'key': None}
 
 def handle_exit(signum, frame):
-    global RUNNING
     logging.info("Received termination signal. Exiting gracefully...")
-    RUNNING = False
+    STOP.set()
 
 # Attach signal handlers for graceful termination
 signal.signal(signal.SIGTERM, handle_exit)
 signal.signal(signal.SIGINT, handle_exit)
 
+def run_cycle(client, reconciled_at):
+    # Apply deliveries the web process queued but never got to
+    while not STOP.is_set() and drain_webhook_outbox(client)[0]:
+        pass
+
+    cycle_started = time.perf_counter()
+    repos = allowlist.repos()
+    due, skipped = due_repos(client, repos)
+    if skipped:
+        logging.info(f"Skipping {len(skipped)} repos kept current by webhooks: {skipped}")
+
+    pr_count = 0
+    if due:
+        logging.info(f"Polling {len(due)} due repos: {due}")
+        before = watermarks(client)
+        pr_count = fetch_filtered_prs(client, due)
+        if STOP.is_set():
+            # Interrupted repos keep their schedule and stay due
+            return reconciled_at, 0
+        after = watermarks(client)
+        record_polls(client, {repo: after.get(repo) != before.get(repo) for repo in due})
+
+    values = {'cron_repos_polled': len(due), 'cron_repos_skipped': len(skipped)}
+    # Webhooks and polls apply deltas; the full drift check runs on its own
+    # cadence, or straight away when scoring.json changed
+    if STOP.is_set():
+        return reconciled_at, 0
+    rules_key = scoring_rules.current().key()
+    if time.time() - reconciled_at >= RECONCILE_INTERVAL or rules_key != APPLIED_RULES['key']:
+        reconcile_started = time.perf_counter()
+        drifted = reconcile_leaderboard(client)
+        reconciled_at = time.time()
+        APPLIED_RULES['key'] = rules_key
+        values['leaderboard_recompute_seconds'] = time.perf_counter() - reconcile_started
+        values['leaderboard_drift_rows'] = drifted
+        logging.info(f"Updated {pr_count} PRs, reconciled {drifted} leaderboard rows")
+        # Cached responses for PRs and repos no longer synced
+        pruned = github.prune_http_cache(client)
+        if pruned:
+            logging.info(f"Pruned {pruned} stale GitHub cache entries")
+
+    # Picked up by the web process's /metrics
+    values.update({
+        'cron_cycle_seconds': time.perf_counter() - cycle_started,
+        'cron_prs_synced': pr_count,
+        'cron_last_success_timestamp': time.time(),
+    })
+    record_shared(client, values)
+    # GitHub request counts and the like, merged into the web's /metrics
+    flush_metrics(client)
+    return reconciled_at, next_wakeup(client, allowlist.repos())
+
 def cron_worker():
-    global RUNNING
     client = None
     attempts = 0
+    reconciled_at = 0
 
-    while RUNNING:
+    while not STOP.is_set():
         try:
             if client is None or client.isolation_level is None:
                 client = connect_db()
+                setup_database(client)
 
-            logging.info("Running PR fetch...")
-
-            pr_count = fetch_filtered_prs(client)
-            update_leaderboard(client)
-            logging.info(f"Updated {pr_count} PRs")
-
+            reconciled_at, wait_time = run_cycle(client, reconciled_at)
             attempts = 0  # Reset attempts if successful
 
+            # Wake up for the next due repo or reconcile, whichever comes
+            # first, and at least every SCHEDULER_MIN_INTERVAL to notice
+            # newly tracked repos
+            wait_time = min(wait_time, max(0, reconciled_at + RECONCILE_INTERVAL - time.time()), SCHEDULER_MIN_INTERVAL)
+
         except Exception as e:
             attempts += 1
             wait_time = min(60 * (2 ** attempts), 300)  # Exponential backoff (max 5 min)
             logging.error(f"Error in cron job: {str(e)}. Retrying in {wait_time} seconds.")
-            time.sleep(wait_time)
 
-        time.sleep(45 * 60)  # Sleep for 45 minutes before the next run
+        # SIGTERM ends the wait immediately
+        STOP.wait(max(wait_time, 1))
 
+    if client is not None:
+        try:
+            retire_metrics(client)
+        except Exception as e:
+            logging.error(f"Failed to retire cron metrics: {str(e)}")
     logging.info("Cron worker exiting...")
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from configs.globals import DASHBOARD_CACHE_SIZE, LOG_LEVEL
+from allowlist import allowlist
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# github_user -> (cache key, serialized body), least recently used first
+_cache_lock = threading.Lock()
+_cache = OrderedDict()
+
+
+def _build_dashboard(client, github_user):
+    # The user row and all of their PRs in one round trip
+    rows = client.execute("""
+    SELECT users.id, users.github_user, users.email,
+           pull_requests.repo_name, pull_requests.status, pull_requests.pr_id
+    FROM users
+    LEFT JOIN pull_requests ON pull_requests.github_login = users.github_user
+    WHERE users.github_user = ?
+    """, (github_user,)).fetchall()
+
+    if not rows:
+        return None
+
+    contributed = []
+    pr_list = []
+    for _, _, _, repo_name, status, pr_id in rows:
+        if pr_id is None:
+            continue
+        # Matched on the full owner/name so same-named forks do not count
+        if repo_name not in contributed and allowlist.get(repo_name):
+            contributed.append(repo_name)
+        pr_list.append({'repo_name': repo_name, 'status': status, 'pr_id': pr_id})
+
+    user_data = {
+        'SOCid': rows[0][0],
+        'username': rows[0][1],
+        'email': rows[0][2],
+        'contributed_repos': [{'repo_name': repo} for repo in contributed],
+        'pull_requests': pr_list
+    }
+    return json.dumps({'user': user_data}).encode('utf-8')
+
+
+def load_dashboard(client, github_user):
+    row = client.execute(
+        "SELECT data_version FROM users WHERE github_user = ?",
+        (github_user,)
+    ).fetchone()
+    if not row:
+        return None
+
+    key = (row[0], allowlist.version())
+    with _cache_lock:
+        cached = _cache.get(github_user)
+        if cached and cached[0] == key:
+            _cache.move_to_end(github_user)
+            return cached[1]
+
+    body = _build_dashboard(client, github_user)
+    if body is None:
+        return None
+
+    with _cache_lock:
+        _cache[github_user] = (key, body)
+        _cache.move_to_end(github_user)
+        while len(_cache) > DASHBOARD_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return body
@@ -1,26 +1,128 @@
 import os
+import queue
 import sqlite3
 import logging
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-import requests
-from utils import fetch_user_repos
+from configs.globals import EXPORT_BATCH_SIZE, LOG_LEVEL
+from leaderboard import RANKED_QUERY, bump_leaderboard_version, score_users
+from metrics import connection_factory
 
 load_dotenv()
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 
 DB_PATH = os.getenv('SQLITE_DB_PATH','./app.db')
+POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.getenv('SQLITE_POOL_TIMEOUT', 10))
+BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
 
 def connect_db():
     logging.debug("Connecting to database...")
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn = sqlite3.connect(
+        DB_PATH, check_same_thread=False, timeout=BUSY_TIMEOUT_MS / 1000, factory=connection_factory()
+    )
     if not isinstance(conn, sqlite3.Connection):
         raise Exception("Failed to establish database connection.")
+
+    # Applied once per connection; pooled connections keep them for life
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
     return conn
 
-client = connect_db()
 
-def setup_database():
-    logging.debug("Setting up database.")
+class ConnectionPool:
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error as e:
+            logging.warning(f"Discarding broken pooled connection: {e}")
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def acquire(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return connect_db()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise Exception(f"Timed out waiting for a database connection (pool size {self.size}).")
+
+            if self._healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def after_fork(self):
+        # SQLite connections must not cross a fork. Inherited ones are dropped
+        # without closing them, since the parent process still owns them.
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+pool = ConnectionPool()
+
+def _columns(client, table):
+    return {row[1] for row in client.execute(f"PRAGMA table_info({table})")}
+
+def _migration_initial_schema(client):
     client.execute("""
     CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY,
@@ -64,17 +166,337 @@ def setup_database():
         token TEXT
     );
     """)
-    
-    logging.debug("Database setup complete.")
 
-def save_user_to_db(github_user, name, email, contact, avatar, link):
     client.execute("""
-    INSERT OR REPLACE INTO users (github_user, name, email, contact, avatar, link)
-    VALUES (?, ?, ?, ?, ?, ?)
-    """, (github_user, name, email, contact, avatar, link))
+    CREATE TABLE IF NOT EXISTS pr_sync_state (
+        pr_id INTEGER PRIMARY KEY,
+        updated_at TEXT
+    );
+    """)
+
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS repo_sync_state (
+        repo_name TEXT PRIMARY KEY,
+        last_updated_at TEXT,
+        users_seen INTEGER DEFAULT 0
+    );
+    """)
+
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS http_cache (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        body BLOB,
+        link TEXT,
+        fetched_at REAL
+    );
+    """)
+
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS webhook_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        pr_id INTEGER NOT NULL,
+        repo_name TEXT NOT NULL,
+        github_login TEXT NOT NULL,
+        total_commits INTEGER DEFAULT 0,
+        total_lines INTEGER DEFAULT 0,
+        status TEXT,
+        received_at REAL
+    );
+    """)
+
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS app_state (
+        key TEXT PRIMARY KEY,
+        value INTEGER DEFAULT 0
+    );
+    """)
+
+def _migration_pull_request_ids(client):
+    # The original DDL keyed PRs by a local id and github_user, while every
+    # query (and the webhook ON CONFLICT) uses GitHub's pr_id and github_login.
+    columns = _columns(client, 'pull_requests')
+    id_column = 'pr_id' if 'pr_id' in columns else 'id'
+    login_column = 'github_login' if 'github_login' in columns else 'github_user'
+
+    client.execute("""
+    CREATE TABLE pull_requests_new (
+        pr_id INTEGER PRIMARY KEY,
+        repo_name TEXT NOT NULL,
+        github_login TEXT NOT NULL,
+        total_commits INTEGER DEFAULT 0,
+        total_lines INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'open'
+    );
+    """)
+    client.execute(f"""
+    INSERT OR REPLACE INTO pull_requests_new (pr_id, repo_name, github_login, total_commits, total_lines, status)
+    SELECT {id_column}, repo_name, {login_column}, total_commits, total_lines, status
+    FROM pull_requests
+    """)
+    client.execute("DROP TABLE pull_requests")
+    client.execute("ALTER TABLE pull_requests_new RENAME TO pull_requests")
+
+def _migration_leaderboard_user_id(client):
+    columns = _columns(client, 'leaderboard')
+    id_column = 'user_id' if 'user_id' in columns else 'id'
+
+    client.execute("""
+    CREATE TABLE leaderboard_new (
+        user_id INTEGER PRIMARY KEY,
+        total_prs INTEGER DEFAULT 0,
+        total_commits INTEGER DEFAULT 0,
+        total_lines INTEGER DEFAULT 0,
+        points INTEGER DEFAULT 0,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    """)
+    client.execute(f"""
+    INSERT OR REPLACE INTO leaderboard_new (user_id, total_prs, total_commits, total_lines, points)
+    SELECT {id_column}, total_prs, total_commits, total_lines, points
+    FROM leaderboard
+    """)
+    client.execute("DROP TABLE leaderboard")
+    client.execute("ALTER TABLE leaderboard_new RENAME TO leaderboard")
+
+def _migration_unique_tokens(client):
+    # save_token relies on INSERT OR REPLACE, which needs a uniqueness constraint
+    client.execute("""
+    DELETE FROM tokens
+    WHERE token IS NULL OR rowid NOT IN (SELECT MIN(rowid) FROM tokens GROUP BY token)
+    """)
+    client.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tokens_token ON tokens(token)")
+
+def _migration_hot_query_indexes(client):
+    # Serves the per-user lookups (dashboard, /api/user/<id>/prs), the
+    # latest-PR-per-(repo, user) lookup behind leaderboard deltas and the
+    # GROUP BY in the full recompute, all without touching the table.
+    client.execute("""
+    CREATE INDEX IF NOT EXISTS idx_pull_requests_login_repo
+    ON pull_requests(github_login, repo_name, pr_id)
+    """)
+    client.execute("""
+    CREATE INDEX IF NOT EXISTS idx_leaderboard_total_prs
+    ON leaderboard(total_prs DESC)
+    """)
+
+def _migration_user_data_version(client):
+    # Bumped whenever a user's profile or PRs change; keys the dashboard cache
+    client.execute("ALTER TABLE users ADD COLUMN data_version INTEGER DEFAULT 0")
+
+def _migration_user_prs_keyset_index(client):
+    # pr_id is the rowid, so this index is ordered by (github_login, pr_id)
+    # and serves keyset pages of one user's PRs as a range scan.
+    client.execute("CREATE INDEX IF NOT EXISTS idx_pull_requests_login ON pull_requests(github_login)")
+
+def _migration_leaderboard_points_index(client):
+    # Ranked views order by points; top-N reads walk this index
+    client.execute("""
+    CREATE INDEX IF NOT EXISTS idx_leaderboard_points
+    ON leaderboard(points DESC, total_prs DESC, user_id)
+    """)
+
+def _migration_webhook_deliveries(client):
+    # X-GitHub-Delivery IDs already queued, so redeliveries are dropped. Rows
+    # expire after WEBHOOK_DELIVERY_TTL; the index serves that purge.
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS webhook_deliveries (
+        delivery_id TEXT PRIMARY KEY,
+        received_at REAL NOT NULL
+    );
+    """)
+    client.execute("""
+    CREATE INDEX IF NOT EXISTS idx_webhook_deliveries_received_at
+    ON webhook_deliveries(received_at)
+    """)
+
+def _migration_tracked_repos(client):
+    # Per-repo config on top of the filter file; repos listed here are tracked
+    # even when the file does not name them. Times are unix timestamps.
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS tracked_repos (
+        repo_name TEXT PRIMARY KEY COLLATE NOCASE,
+        weight REAL NOT NULL DEFAULT 1,
+        active_from REAL,
+        active_until REAL
+    );
+    """)
+
+def _migration_repo_schedule(client):
+    # Cron polling state per repo; webhook_at is the last outbox drain that
+    # touched the repo
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS repo_schedule (
+        repo_name TEXT PRIMARY KEY COLLATE NOCASE,
+        next_due_at REAL NOT NULL,
+        interval REAL NOT NULL,
+        last_polled_at REAL,
+        webhook_at REAL
+    );
+    """)
+
+def _migration_score_history(client):
+    # When GitHub last reported a change to the PR (unix seconds)
+    if 'updated_at' not in _columns(client, 'pull_requests'):
+        client.execute("ALTER TABLE pull_requests ADD COLUMN updated_at REAL")
+
+    # Net change to each user's standing per UTC day. Rows only ever grow
+    # by upsert, one per (day, user), and summed over all days they equal
+    # the leaderboard table.
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS score_history (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        total_prs INTEGER NOT NULL DEFAULT 0,
+        total_commits INTEGER NOT NULL DEFAULT 0,
+        total_lines INTEGER NOT NULL DEFAULT 0,
+        points INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id)
+    );
+    """)
+    # Standings from before history was kept have no date; they sit on an
+    # epoch baseline that counts all-time but falls outside every window
+    client.execute("""
+    INSERT OR IGNORE INTO score_history (day, user_id, total_prs, total_commits, total_lines, points)
+    SELECT '1970-01-01', user_id, total_prs, total_commits, total_lines, points
+    FROM leaderboard
+    """)
+
+def _migration_metric_snapshots(client):
+    # Each process's latest metric values, merged when /metrics is scraped.
+    # Exited workers are folded into the 'retired' row.
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS metric_snapshots (
+        worker TEXT PRIMARY KEY,
+        families TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """)
+
+# Append only: each entry runs exactly once per database, in order
+MIGRATIONS = [
+    (1, _migration_initial_schema),
+    (2, _migration_pull_request_ids),
+    (3, _migration_leaderboard_user_id),
+    (4, _migration_unique_tokens),
+    (5, _migration_hot_query_indexes),
+    (6, _migration_user_data_version),
+    (7, _migration_user_prs_keyset_index),
+    (8, _migration_leaderboard_points_index),
+    (9, _migration_webhook_deliveries),
+    (10, _migration_tracked_repos),
+    (11, _migration_repo_schedule),
+    (12, _migration_score_history),
+    (13, _migration_metric_snapshots),
+]
+
+def migrate(client):
+    client.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        applied_at REAL
+    );
+    """)
+    client.commit()
+
+    # Takes the write lock so processes starting together migrate only once
+    client.execute("BEGIN IMMEDIATE")
+    try:
+        current = client.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            logging.info(f"Applying schema migration {version}: {migration.__name__}")
+            migration(client)
+            client.execute(
+                "INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                (version, time.time())
+            )
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
+    return MIGRATIONS[-1][0]
+
+# Point lookups that must stay index-backed; see check_query_plans
+HOT_QUERIES = {
+    'latest_pr_for_repo_user': (
+        "SELECT total_commits, total_lines, status FROM pull_requests "
+        "WHERE repo_name = ? AND github_login = ? ORDER BY pr_id DESC LIMIT 1",
+        ('', ''),
+    ),
+    'user_repos': ("SELECT DISTINCT repo_name FROM pull_requests WHERE github_login = ?", ('',)),
+    'user_prs_page': (
+        "SELECT pr_id, repo_name, total_commits, total_lines, status FROM pull_requests "
+        "WHERE github_login = ? AND pr_id > ? ORDER BY pr_id LIMIT ?",
+        ('', 0, 10),
+    ),
+    'user_by_login': ("SELECT * FROM users WHERE github_user = ?", ('',)),
+}
+
+def check_query_plans(client):
+    # Returns the hot queries whose plan falls back to a full table scan
+    slow = {}
+    for name, (query, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in client.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        if any(step.startswith('SCAN') for step in plan):
+            slow[name] = plan
+    return slow
+
+def setup_database(client=None):
+    if client is None:
+        with pool.connection() as client:
+            return setup_database(client)
+
+    logging.debug("Setting up database.")
+    version = migrate(client)
+
+    for name, plan in check_query_plans(client).items():
+        logging.warning(f"Query {name} is not index-backed: {plan}")
+    logging.debug(f"Database setup complete at schema version {version}.")
+
+UPSERT_USER = """
+INSERT INTO users (github_user, name, email, contact, avatar, link)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(github_user) DO UPDATE SET
+name = excluded.name,
+email = excluded.email,
+contact = excluded.contact,
+avatar = excluded.avatar,
+link = excluded.link,
+data_version = data_version + 1
+"""
+
+def save_user_to_db(client, github_user, name, email, contact, avatar, link):
+    # Update in place on re-registration: REPLACE would hand the user a new
+    # id and orphan their leaderboard row.
+    client.execute(UPSERT_USER, (github_user, name, email, contact, avatar, link))
+    # Scored right away so the user is ranked, PRs from before registering
+    # included, without waiting for the next reconcile
+    score_users(client, [github_user])
+    # Names are shown on the leaderboard, so cached snapshots go stale too
+    bump_leaderboard_version(client)
     
     client.commit()
-def save_token(token):
+
+def save_users_to_db(client, users):
+    # Bulk form of save_user_to_db: all rows land in one transaction and
+    # the leaderboard version moves once
+    try:
+        client.executemany(UPSERT_USER, users)
+        score_users(client, [user[0] for user in users])
+        bump_leaderboard_version(client)
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
+
+def get_registered_logins(client):
+    # Lowercased login -> login as stored, for case-insensitive checks
+    return {row[0].lower(): row[0] for row in client.execute("SELECT github_user FROM users")}
+
+def save_token(client, token):
     client.execute("""
     INSERT OR REPLACE INTO tokens (token)
     VALUES (?)
@@ -82,7 +504,10 @@ def save_token(token):
     
     client.commit()
 
-def get_all_users():
+def get_all_users(client):
+    # Imported here: utils depends on github, which uses this module's pool
+    from utils import fetch_user_repos
+
     res = client.execute("SELECT * FROM users").fetchall()
     users = []
 
@@ -110,13 +535,49 @@ def get_all_users():
     return users
 
 def validate_tokens(client):
-    tokens = client.execute("SELECT key FROM api_keys").fetchall()[0]
-    for token in tokens:
-        response = requests.get(
-            "https://api.github.com/user",
-            headers={"Authorization": f"token {token[0]}"}
-        )
+    from github import github_get
+
+    tokens = client.execute("SELECT DISTINCT token FROM tokens WHERE token IS NOT NULL").fetchall()
+    for (token,) in tokens:
+        response = github_get("user", token=token)
         if response.status_code == 401:  
-            logging.warning(f"Removing invalid token: {token[0]}")
+            logging.warning(f"Removing invalid token ending {token[-4:]}")
+            client.execute("DELETE FROM tokens WHERE token = ?", (token,))
         else:
-            logging.info(f"Token {token[0]} is valid.")
+            logging.info(f"Token ending {token[-4:]} is valid.")
+    client.commit()
+
+
+EXPORTS = {
+    'users': """
+    SELECT id, github_user, name, email, contact, avatar, link
+    FROM users ORDER BY id
+    """,
+    'prs': """
+    SELECT pr_id, repo_name, github_login, total_commits, total_lines, status, updated_at
+    FROM pull_requests ORDER BY pr_id
+    """,
+    # Ranked exactly like the public leaderboard
+    'leaderboard': f"""
+    SELECT position, rank, github_user, name, total_prs, total_commits, total_lines, points
+    FROM ({RANKED_QUERY})
+    ORDER BY position
+    """,
+}
+
+def export_rows(kind, batch_size=EXPORT_BATCH_SIZE):
+    # Yields the column names, then every row. One statement read in
+    # batches is one WAL snapshot, so the export is consistent without
+    # holding more than a batch in memory. Takes its own pooled connection:
+    # the request's is released before a streamed response finishes.
+    with pool.connection() as client:
+        cursor = client.execute(EXPORTS[kind])
+        try:
+            yield tuple(column[0] for column in cursor.description)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
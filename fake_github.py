@@ -0,0 +1,103 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeGitHub:
+    # Just enough of the REST API for the cron path: paginated PR listings
+    # with Link headers, PR details, ETag revalidation and rate limit headers.
+    # prs_by_repo maps owner/name to PR dicts as the listing returns them,
+    # each with a '_details' dict for the detail endpoint. Used by
+    # benchmark.py and the ingestion tests.
+
+    def __init__(self, prs_by_repo):
+        self.prs_by_repo = prs_by_repo
+        self.requests = 0
+        self.not_modified = 0
+        # Request paths in arrival order, with whether each was answered 304
+        self.log = []
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                status, body, headers = fake.respond(self.path, self.headers.get('Host'))
+                payload = json.dumps(body).encode('utf-8')
+                etag = f'"{hash(payload) & 0xffffffff:x}"'
+                not_modified = status == 200 and self.headers.get('If-None-Match') == etag
+                with fake._lock:
+                    fake.log.append((self.path, not_modified))
+                if not_modified:
+                    with fake._lock:
+                        fake.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('ETag', etag)
+                self.send_header('X-RateLimit-Remaining', '4999')
+                self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def respond(self, path, host):
+        url = urlparse(path)
+        query = parse_qs(url.query)
+
+        detail = re.match(r'^/repos/([^/]+/[^/]+)/pulls/(\d+)$', url.path)
+        if detail:
+            prs = self.prs_by_repo.get(detail.group(1), [])
+            number = int(detail.group(2))
+            pr = next((pr for pr in prs if pr['number'] == number), None)
+            if pr is None:
+                return 404, {'message': 'Not Found'}, {}
+            return 200, pr['_details'], {}
+
+        listing = re.match(r'^/repos/([^/]+/[^/]+)/pulls$', url.path)
+        if listing:
+            prs = sorted(self.prs_by_repo.get(listing.group(1), []), key=lambda pr: pr['updated_at'], reverse=True)
+            per_page = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            body = [
+                {key: value for key, value in pr.items() if key != '_details'}
+                for pr in prs[(page - 1) * per_page:page * per_page]
+            ]
+            headers = {}
+            if page * per_page < len(prs):
+                headers['Link'] = (
+                    f'<http://{host}{url.path}?state=all&sort=updated&direction=desc'
+                    f'&per_page={per_page}&page={page + 1}>; rel="next"'
+                )
+            return 200, body, headers
+
+        if url.path == '/user':
+            return 200, {'login': 'bench', 'avatar_url': '', 'html_url': ''}, {}
+
+        return 404, {'message': 'Not Found'}, {}
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
@@ -0,0 +1,291 @@
+import logging
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import db
+from metrics import observe_github_request, register_collector
+from configs.globals import (
+    CRON_TOKEN, GITHUB_API_URL, GITHUB_MAX_RATE_WAIT, GITHUB_TIMEOUT, HTTP_CACHE_TTL, INGEST_WORKERS, LOG_LEVEL
+)
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Shared keep-alive session; the connection pool is sized for the ingestion
+# thread pool so parallel requests reuse sockets instead of reconnecting.
+session = requests.Session()
+session.headers.update({'Accept': 'application/vnd.github.v3+json'})
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(INGEST_WORKERS, 10))
+session.mount('https://', _adapter)
+session.mount('http://', _adapter)
+
+
+def api_url(path):
+    if path.startswith('http://') or path.startswith('https://'):
+        return path
+    return f"{GITHUB_API_URL}/{path.lstrip('/')}"
+
+
+class RateLimitExhausted(Exception):
+    pass
+
+
+class ShuttingDown(Exception):
+    pass
+
+
+# Set by the cron worker on SIGTERM: token waits end at once and ingestion
+# stops between pages and batches instead of finishing the cycle
+STOP = threading.Event()
+
+
+class TokenPool:
+    # GitHub's default hourly budget, assumed until a response tells us otherwise
+    DEFAULT_LIMIT = 5000
+
+    def __init__(self, refresh_interval=300):
+        self.refresh_interval = refresh_interval
+        self._cond = threading.Condition()
+        self._state = {}
+        self._loaded_at = 0
+
+    def refresh(self):
+        tokens = set()
+        if CRON_TOKEN:
+            tokens.add(CRON_TOKEN)
+        try:
+            with db.pool.connection() as client:
+                tokens.update(row[0] for row in client.execute("SELECT DISTINCT token FROM tokens WHERE token IS NOT NULL"))
+        except Exception as e:
+            logging.error(f"Failed to load tokens: {str(e)}")
+
+        with self._cond:
+            for token in tokens:
+                self._state.setdefault(token, {'remaining': self.DEFAULT_LIMIT, 'reset': 0})
+            for token in list(self._state):
+                if token not in tokens:
+                    del self._state[token]
+            self._loaded_at = time.time()
+            self._cond.notify_all()
+        logging.info(f"Token pool holds {len(tokens)} tokens.")
+
+    def _budget(self, state, now):
+        # A token whose window has reset gets its full budget back
+        if state['reset'] and state['reset'] <= now:
+            state['remaining'] = self.DEFAULT_LIMIT
+            state['reset'] = 0
+        return state['remaining']
+
+    def acquire(self, max_wait=GITHUB_MAX_RATE_WAIT, stop=STOP):
+        if time.time() - self._loaded_at > self.refresh_interval:
+            self.refresh()
+
+        deadline = time.time() + max_wait
+        waiting = False
+        with self._cond:
+            while True:
+                if stop.is_set():
+                    raise ShuttingDown("Shutting down, not waiting for a GitHub token.")
+                now = time.time()
+                if not self._state:
+                    raise RateLimitExhausted("No GitHub tokens available.")
+
+                token, state = max(self._state.items(), key=lambda item: self._budget(item[1], now))
+                if state['remaining'] > 0:
+                    # Reserve one call up front so concurrent threads spread across tokens
+                    state['remaining'] -= 1
+                    return token
+
+                wake_at = min(s['reset'] or now + 60 for s in self._state.values())
+                if wake_at > deadline:
+                    raise RateLimitExhausted(f"All GitHub tokens exhausted until {int(wake_at)}.")
+                if not waiting:
+                    logging.warning(f"All GitHub tokens exhausted. Waiting {int(wake_at - now) + 1} seconds...")
+                    waiting = True
+                # Woken every second at most to notice stop
+                self._cond.wait(timeout=min(wake_at - now + 1, 1))
+
+    def update(self, token, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        rate_limited = is_rate_limited(response)
+
+        with self._cond:
+            state = self._state.get(token)
+            if state is None:
+                return
+            if remaining is not None:
+                state['remaining'] = int(remaining)
+            if reset is not None:
+                state['reset'] = int(reset)
+            if rate_limited:
+                state['remaining'] = 0
+                retry_after = response.headers.get('Retry-After')
+                if retry_after:
+                    state['reset'] = max(state['reset'], int(time.time()) + int(retry_after))
+                elif not state['reset']:
+                    state['reset'] = int(time.time()) + 60
+            self._cond.notify_all()
+
+    def discard(self, token):
+        with self._cond:
+            self._state.pop(token, None)
+        try:
+            with db.pool.connection() as client:
+                client.execute("DELETE FROM tokens WHERE token = ?", (token,))
+                client.commit()
+        except Exception as e:
+            logging.error(f"Failed to delete invalid token: {str(e)}")
+        logging.warning(f"Removed invalid token ending {token[-4:]} from the pool.")
+
+    def snapshot(self):
+        with self._cond:
+            return {token[-4:]: dict(state) for token, state in self._state.items()}
+
+
+token_pool = TokenPool()
+
+
+def is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+    return response.status_code == 403 and (
+        response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers
+    )
+
+
+# Process-wide counters for the conditional request cache
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+
+
+def cache_stats():
+    with _cache_lock:
+        return dict(_cache_stats)
+
+
+def _count(key, amount=1):
+    with _cache_lock:
+        _cache_stats[key] += amount
+
+
+def _github_metrics():
+    tokens = token_pool.snapshot().values()
+    cache = cache_stats()
+    return [
+        ('pullranker_github_tokens', 'gauge', 'Tokens in the rotation pool.', [({}, len(tokens))]),
+        ('pullranker_github_rate_limit_remaining', 'gauge', 'Calls left across all pooled tokens.',
+         [({}, sum(state['remaining'] for state in tokens))]),
+        ('pullranker_github_cache_hits_total', 'counter', 'Requests answered with 304 Not Modified.',
+         [({}, cache['hits'])]),
+        ('pullranker_github_cache_misses_total', 'counter', 'Requests that downloaded a fresh body.',
+         [({}, cache['misses'])]),
+        ('pullranker_github_cache_bytes_saved_total', 'counter', 'Body bytes served from http_cache.',
+         [({}, cache['bytes_saved'])]),
+    ]
+
+
+register_collector(_github_metrics)
+
+
+def _timed_get(url, headers, params, timeout):
+    started = time.perf_counter()
+    response = session.get(url, headers=headers, params=params, timeout=timeout)
+    observe_github_request(response.status_code, time.perf_counter() - started)
+    return response
+
+
+def github_get(path, token=None, params=None, timeout=GITHUB_TIMEOUT, headers=None):
+    # An explicit token (e.g. a user's OAuth token) is used as-is; otherwise
+    # each attempt is dispatched to the pooled token with the most budget left.
+    if token:
+        headers = dict(headers or {}, Authorization=f'token {token}')
+        return _timed_get(api_url(path), headers, params, timeout)
+
+    while True:
+        pooled = token_pool.acquire()
+        attempt_headers = dict(headers or {}, Authorization=f'token {pooled}')
+        response = _timed_get(api_url(path), attempt_headers, params, timeout)
+        token_pool.update(pooled, response)
+
+        if response.status_code == 401:
+            token_pool.discard(pooled)
+            continue
+        if is_rate_limited(response):
+            logging.warning(f"Token ending {pooled[-4:]} hit the rate limit. Trying another...")
+            continue
+        return response
+
+
+# How stale fetched_at may get before a 304 refreshes it
+CACHE_TOUCH_INTERVAL = 24 * 3600
+
+
+def prune_http_cache(client, ttl=HTTP_CACHE_TTL):
+    pruned = client.execute(
+        "DELETE FROM http_cache WHERE COALESCE(fetched_at, 0) < ?",
+        (time.time() - ttl,)
+    ).rowcount
+    client.commit()
+    return pruned
+
+
+def cached_github_get(path, token=None, params=None, timeout=GITHUB_TIMEOUT):
+    # Revalidates against the copy stored in http_cache. GitHub answers an
+    # unchanged resource with 304, which does not count against the rate
+    # limit, and the stored body is handed back as a normal 200 response.
+    url = requests.Request('GET', api_url(path), params=params).prepare().url
+
+    with db.pool.connection() as client:
+        cached = client.execute(
+            "SELECT etag, last_modified, body, link, fetched_at FROM http_cache WHERE url = ?",
+            (url,)
+        ).fetchone()
+
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers['If-None-Match'] = cached[0]
+        if cached[1]:
+            headers['If-Modified-Since'] = cached[1]
+
+    response = github_get(url, token=token, timeout=timeout, headers=headers)
+
+    if response.status_code == 304 and cached:
+        _count('hits')
+        _count('bytes_saved', len(cached[2]))
+        response.status_code = 200
+        response._content = cached[2]
+        # Pagination depends on Link, which a 304 is not guaranteed to repeat
+        if cached[3] and 'Link' not in response.headers:
+            response.headers['Link'] = cached[3]
+        response.from_cache = True
+        # fetched_at is when the copy was last confirmed, which is what
+        # pruning goes by; refreshed at most daily to keep 304s read-only
+        if time.time() - (cached[4] or 0) > CACHE_TOUCH_INTERVAL:
+            with db.pool.connection() as client:
+                client.execute("UPDATE http_cache SET fetched_at = ? WHERE url = ?", (time.time(), url))
+                client.commit()
+        return response
+
+    response.from_cache = False
+    if response.status_code == 200:
+        _count('misses')
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            with db.pool.connection() as client:
+                client.execute("""
+                INSERT INTO http_cache (url, etag, last_modified, body, link, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                body = excluded.body,
+                link = excluded.link,
+                fetched_at = excluded.fetched_at
+                """, (url, etag, last_modified, response.content, response.headers.get('Link'), time.time()))
+                client.commit()
+
+    return response
@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+
+import db
+import metrics
+from configs.globals import STREAM_RESERVED_THREADS
+from stream import broadcaster
+from webhooks import start_webhook_worker
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+wsgi_app = 'main:create_app()'
+
+# Requests mostly wait on SQLite or GitHub, so each worker also serves a few
+# threads; writes are serialized by SQLite regardless of the worker count.
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Every open /leaderboard/stream client here holds a thread for as long as
+# it is connected, so post_fork caps streams below the thread count. Stream
+# clients belong on gunicorn.stream.conf.py; these few are only a fallback.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+
+# Import the app and run migrations once in the master before forking
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+
+def post_fork(server, worker):
+    db.pool.after_fork()
+    metrics.after_fork()
+    metrics.start_flusher()
+    # Threads do not survive a fork; each worker drains the webhook outbox
+    # itself, starting with whatever was queued before a restart.
+    start_webhook_worker()
+    # A sync or gthread worker has a fixed number of threads; a stream may
+    # only take those beyond the ones kept for ordinary requests
+    if server.cfg.worker_class_str in ('sync', 'gthread'):
+        broadcaster.max_clients = min(broadcaster.max_clients, max(0, server.cfg.threads - STREAM_RESERVED_THREADS))
+        worker.log.info(f"Serving at most {broadcaster.max_clients} leaderboard streams.")
+
+
+def worker_exit(server, worker):
+    # Keeps the exiting worker's counts in the merged /metrics totals
+    try:
+        with db.pool.connection() as client:
+            metrics.retire(client)
+    except Exception as e:
+        worker.log.error(f"Failed to retire worker metrics: {str(e)}")
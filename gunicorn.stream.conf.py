@@ -0,0 +1,26 @@
+import os
+
+from configs.globals import STREAM_MAX_CLIENTS
+
+# Serves /leaderboard/stream on its own port with gevent, where an open
+# client costs a greenlet rather than an OS thread. Route the stream path
+# here from the proxy; gunicorn.conf.py serves everything else.
+bind = os.getenv('STREAM_BIND', '0.0.0.0:5001')
+wsgi_app = 'stream:create_stream_app()'
+
+worker_class = 'gevent'
+# Each worker runs its own poller and serves up to STREAM_MAX_CLIENTS
+workers = int(os.getenv('STREAM_WORKERS', 1))
+worker_connections = STREAM_MAX_CLIENTS + 100
+
+# gevent has to patch threading and queue before the app creates its
+# locks and poller, so the app is imported in each worker, after the patch
+preload_app = False
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
@@ -0,0 +1,574 @@
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from configs.globals import LOG_LEVEL, REBUILD_CHUNK_SIZE, REBUILD_PAUSE
+from scoring import rules as scoring_rules
+
+logging.basicConfig(level=LOG_LEVEL)
+
+LEADERBOARD_VERSION_KEY = 'leaderboard_version'
+
+# Serialized /leaderboard response, rebuilt only when the version stored in
+# app_state moves. The version lives in SQLite so bumps made by the cron
+# worker process are seen by the web workers as well.
+_snapshot_lock = threading.Lock()
+_snapshot = (None, None)
+
+# Dense rank shares a rank between tied scores; position is a unique, stable
+# ordinal used to cut windows without OFFSET.
+RANKED_QUERY = """
+SELECT users.github_user, users.name, leaderboard.total_prs, leaderboard.points,
+       DENSE_RANK() OVER (ORDER BY leaderboard.points DESC) AS rank,
+       ROW_NUMBER() OVER (
+           ORDER BY leaderboard.points DESC, leaderboard.total_prs DESC, leaderboard.user_id
+       ) AS position,
+       leaderboard.total_commits, leaderboard.total_lines
+FROM leaderboard
+JOIN users ON leaderboard.user_id = users.id
+"""
+
+# Ranked views serialized at the current leaderboard version, keyed by view
+# and window; dropped wholesale when the version moves.
+MAX_CACHED_VIEWS = 4096
+_views_lock = threading.Lock()
+_views = {'version': None, 'bodies': {}}
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _repo_contributions(client, pairs):
+    # Latest PR per (repo, user) pair for a whole batch in a few queries,
+    # scored with the same compiled rules as the full recompute
+    rules = scoring_rules.current()
+    contributions = {pair: (0, 0, 0, 0) for pair in pairs}
+    for chunk in _chunks(list(pairs), 400):
+        values = ','.join('(?, ?)' for _ in chunk)
+        params = [value for pair in chunk for value in pair]
+        rows = client.execute(f"""
+        WITH pairs(repo_name, github_login) AS (VALUES {values})
+        SELECT pairs.repo_name, pairs.github_login,
+               {rules.commits_sql('pr')}, {rules.lines_sql('pr')}, {rules.points_sql('pr')}
+        FROM pairs
+        JOIN pull_requests pr ON pr.pr_id = (
+            SELECT MAX(pr_id)
+            FROM pull_requests
+            WHERE repo_name = pairs.repo_name AND github_login = pairs.github_login
+        )
+        LEFT JOIN tracked_repos ON tracked_repos.repo_name = pr.repo_name
+        """, params).fetchall()
+
+        for repo, github_login, total_commits, total_lines, points in rows:
+            contributions[(repo, github_login)] = (1, total_commits, total_lines, points)
+    return contributions
+
+
+def bump_leaderboard_version(client):
+    client.execute("""
+    INSERT INTO app_state (key, value) VALUES (?, 1)
+    ON CONFLICT(key) DO UPDATE SET value = value + 1
+    """, (LEADERBOARD_VERSION_KEY,))
+
+
+def get_leaderboard_version(client):
+    row = client.execute(
+        "SELECT value FROM app_state WHERE key = ?",
+        (LEADERBOARD_VERSION_KEY,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def leaderboard_snapshot(client):
+    global _snapshot
+    version = get_leaderboard_version(client)
+    if _snapshot[0] == version:
+        return _snapshot
+
+    with _snapshot_lock:
+        if _snapshot[0] != version:
+            rows = client.execute("""
+            SELECT users.name, leaderboard.total_prs, leaderboard.points
+            FROM leaderboard
+            JOIN users ON leaderboard.user_id = users.id
+            ORDER BY leaderboard.total_prs DESC
+            """).fetchall()
+            body = json.dumps({'leaderboard': rows}).encode('utf-8')
+            _snapshot = (version, body)
+            logging.debug(f"Rebuilt leaderboard snapshot at version {version}")
+
+    return _snapshot
+
+
+def _cached_view(client, key, build):
+    version = get_leaderboard_version(client)
+    with _views_lock:
+        if _views['version'] != version:
+            _views['version'] = version
+            _views['bodies'] = {}
+        body = _views['bodies'].get(key)
+    if body is not None:
+        return version, body
+
+    body = build(client)
+    if body is not None:
+        with _views_lock:
+            if _views['version'] == version and len(_views['bodies']) < MAX_CACHED_VIEWS:
+                _views['bodies'][key] = body
+    return version, body
+
+
+def _ranked_body(rows):
+    entries = [
+        {'rank': row[4], 'github_user': row[0], 'name': row[1], 'total_prs': row[2], 'points': row[3]}
+        for row in rows
+    ]
+    return json.dumps({'leaderboard': entries}, separators=(',', ':')).encode('utf-8')
+
+
+def top_leaderboard(client, limit):
+    def build(client):
+        rows = client.execute(f"""
+        SELECT * FROM ({RANKED_QUERY})
+        ORDER BY position
+        LIMIT ?
+        """, (limit,)).fetchall()
+        return _ranked_body(rows)
+
+    return _cached_view(client, ('top', limit), build)
+
+
+def leaderboard_around(client, github_user, radius):
+    def build(client):
+        rows = client.execute(f"""
+        WITH ranked AS ({RANKED_QUERY}),
+        me AS (SELECT position FROM ranked WHERE github_user = ?)
+        SELECT ranked.*
+        FROM ranked, me
+        WHERE ranked.position BETWEEN me.position - ? AND me.position + ?
+        ORDER BY ranked.position
+        """, (github_user, radius, radius)).fetchall()
+        return _ranked_body(rows) if rows else None
+
+    return _cached_view(client, ('around', github_user, radius), build)
+
+
+def window_leaderboard(client, days, limit):
+    # Points earned over the last `days` UTC days (today included), summed
+    # from the daily rollups with a range scan on score_history's key
+    since = history_day(time.time() - (days - 1) * 86400)
+
+    def build(client):
+        rows = client.execute("""
+        WITH earned AS (
+            SELECT user_id, SUM(total_prs) AS total_prs, SUM(points) AS points
+            FROM score_history
+            WHERE day >= ?
+            GROUP BY user_id
+        )
+        SELECT users.github_user, users.name, earned.total_prs, earned.points,
+               DENSE_RANK() OVER (ORDER BY earned.points DESC) AS rank
+        FROM earned
+        JOIN users ON users.id = earned.user_id
+        WHERE earned.points != 0 OR earned.total_prs != 0
+        ORDER BY earned.points DESC, earned.total_prs DESC, earned.user_id
+        LIMIT ?
+        """, (since, limit)).fetchall()
+        return _ranked_body(rows)
+
+    # The window slides at midnight, so the day is part of the key
+    return _cached_view(client, ('window', days, limit, since), build)
+
+
+def rank_changes(client, days, limit):
+    # All-time rank now against the rank at the start of the window, i.e.
+    # standings rebuilt from every daily rollup before it. Users whose rank
+    # did not move are left out.
+    since = history_day(time.time() - (days - 1) * 86400)
+
+    def build(client):
+        rows = client.execute(f"""
+        WITH previous AS (
+            SELECT user_id, SUM(points) AS points,
+                   DENSE_RANK() OVER (ORDER BY SUM(points) DESC) AS rank
+            FROM score_history
+            WHERE day < ?
+            GROUP BY user_id
+        ),
+        current AS ({RANKED_QUERY})
+        SELECT current.github_user, current.name, current.rank, previous.rank,
+               current.points, current.points - COALESCE(previous.points, 0)
+        FROM current
+        JOIN users ON users.github_user = current.github_user
+        LEFT JOIN previous ON previous.user_id = users.id
+        WHERE previous.rank IS NULL OR previous.rank != current.rank
+        ORDER BY current.position
+        LIMIT ?
+        """, (since, limit)).fetchall()
+        entries = [
+            {
+                'github_user': row[0], 'name': row[1], 'rank': row[2], 'previous_rank': row[3],
+                'rank_change': row[3] - row[2] if row[3] is not None else None,
+                'points': row[4], 'points_change': row[5],
+            }
+            for row in rows
+        ]
+        return json.dumps({'since': since, 'changes': entries}, separators=(',', ':')).encode('utf-8')
+
+    return _cached_view(client, ('changes', days, limit, since), build)
+
+
+def apply_leaderboard_deltas(client, deltas):
+    # Users who have not registered yet have no leaderboard row; the periodic
+    # reconciliation picks their PRs up once they sign up.
+    rows = [(*delta, github_login) for github_login, delta in deltas.items() if any(delta)]
+    if not rows:
+        return False
+
+    client.executemany("""
+    INSERT INTO leaderboard (user_id, total_prs, total_commits, total_lines, points)
+    SELECT id, ?, ?, ?, ? FROM users WHERE github_user = ?
+    ON CONFLICT(user_id) DO UPDATE SET
+    total_prs = total_prs + excluded.total_prs,
+    total_commits = total_commits + excluded.total_commits,
+    total_lines = total_lines + excluded.total_lines,
+    points = points + excluded.points
+    """, rows)
+    bump_leaderboard_version(client)
+    return True
+
+
+def history_day(timestamp):
+    # Score history is rolled up per UTC day
+    return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+
+
+def record_score_history(client, deltas):
+    # deltas maps (day, github_login) -> (total_prs, total_commits, total_lines, points)
+    rows = [(day, *delta, github_login) for (day, github_login), delta in deltas.items() if any(delta)]
+    client.executemany("""
+    INSERT INTO score_history (day, user_id, total_prs, total_commits, total_lines, points)
+    SELECT ?, id, ?, ?, ?, ? FROM users WHERE github_user = ?
+    ON CONFLICT(day, user_id) DO UPDATE SET
+    total_prs = total_prs + excluded.total_prs,
+    total_commits = total_commits + excluded.total_commits,
+    total_lines = total_lines + excluded.total_lines,
+    points = points + excluded.points
+    """, rows)
+
+
+def upsert_pull_requests(client, records):
+    # records are (pr_id, repo, github_login, total_commits, total_lines, status)
+    # with an optional trailing event time (unix seconds, defaults to now).
+    # Runs inside the caller's transaction: the PR writes and the matching
+    # leaderboard deltas are committed (or rolled back) together.
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    # Later records for the same PR win
+    now = time.time()
+    latest = {}
+    for record in records:
+        event_at = record[6] if len(record) > 6 and record[6] is not None else now
+        latest[record[0]] = tuple(record[:6]) + (event_at,)
+    records = list(latest.values())
+    if not records:
+        return stats
+
+    existing = {}
+    for chunk in _chunks([record[0] for record in records], 500):
+        placeholders = ','.join('?' * len(chunk))
+        existing.update(
+            (row[0], row[1:]) for row in client.execute(f"""
+            SELECT pr_id, total_commits, total_lines, status
+            FROM pull_requests
+            WHERE pr_id IN ({placeholders})
+            """, chunk)
+        )
+
+    changed = []
+    for record in records:
+        current = existing.get(record[0])
+        if current is None:
+            stats['inserted'] += 1
+        elif tuple(current) != tuple(record[3:6]):
+            stats['updated'] += 1
+        else:
+            stats['unchanged'] += 1
+            continue
+        changed.append(record)
+
+    if not changed:
+        return stats
+
+    pairs = {(record[1], record[2]) for record in changed}
+    before = _repo_contributions(client, pairs)
+
+    client.executemany("""
+    INSERT INTO pull_requests (pr_id, repo_name, github_login, total_commits, total_lines, status, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(pr_id) DO UPDATE SET
+    total_commits = excluded.total_commits,
+    total_lines = excluded.total_lines,
+    status = excluded.status,
+    updated_at = excluded.updated_at
+    """, changed)
+
+    logins = {record[2] for record in changed}
+    client.executemany(
+        "UPDATE users SET data_version = data_version + 1 WHERE github_user = ?",
+        [(github_login,) for github_login in logins]
+    )
+
+    # A pair's change is dated by the latest event that touched it
+    event_at = {}
+    for record in changed:
+        pair = (record[1], record[2])
+        event_at[pair] = max(event_at.get(pair, 0), record[6])
+
+    after = _repo_contributions(client, pairs)
+    deltas = {}
+    daily = {}
+    for pair in pairs:
+        delta = tuple(new - old for new, old in zip(after[pair], before[pair]))
+        total = deltas.get(pair[1], (0, 0, 0, 0))
+        deltas[pair[1]] = tuple(a + b for a, b in zip(total, delta))
+        key = (history_day(event_at[pair]), pair[1])
+        total = daily.get(key, (0, 0, 0, 0))
+        daily[key] = tuple(a + b for a, b in zip(total, delta))
+    apply_leaderboard_deltas(client, deltas)
+    record_score_history(client, daily)
+    return stats
+
+
+def find_leaderboard_drift(client, rules=None):
+    rules = rules or scoring_rules.current()
+    return client.execute(f"""
+    WITH standings AS ({rules.standings_query()})
+    SELECT standings.user_id
+    FROM standings
+    LEFT JOIN leaderboard ON leaderboard.user_id = standings.user_id
+    WHERE leaderboard.user_id IS NULL
+       OR leaderboard.total_prs != standings.total_prs
+       OR leaderboard.total_commits != standings.total_commits
+       OR leaderboard.total_lines != standings.total_lines
+       OR leaderboard.points != standings.points
+    """).fetchall()
+
+
+REBUILD_LEASE_KEY = 'leaderboard_rebuild_started'
+# A rebuild that has not finished in this long is assumed to have died
+REBUILD_LEASE = 3600
+
+
+def _book_history(client, standings, params=()):
+    # Any difference between the recomputed standings and the sum of the
+    # history is booked to today, so score_history always adds up to the
+    # true standings even when the leaderboard itself had drifted
+    client.execute(f"""
+    WITH standings AS ({standings}),
+    history AS (
+        SELECT user_id, SUM(total_prs) AS total_prs, SUM(total_commits) AS total_commits,
+               SUM(total_lines) AS total_lines, SUM(points) AS points
+        FROM score_history
+        WHERE user_id IN (SELECT user_id FROM standings)
+        GROUP BY user_id
+    )
+    INSERT INTO score_history (day, user_id, total_prs, total_commits, total_lines, points)
+    SELECT ?, standings.user_id,
+           standings.total_prs - COALESCE(history.total_prs, 0),
+           standings.total_commits - COALESCE(history.total_commits, 0),
+           standings.total_lines - COALESCE(history.total_lines, 0),
+           standings.points - COALESCE(history.points, 0)
+    FROM standings
+    LEFT JOIN history ON history.user_id = standings.user_id
+    WHERE standings.total_prs != COALESCE(history.total_prs, 0)
+       OR standings.total_commits != COALESCE(history.total_commits, 0)
+       OR standings.total_lines != COALESCE(history.total_lines, 0)
+       OR standings.points != COALESCE(history.points, 0)
+    ON CONFLICT(day, user_id) DO UPDATE SET
+    total_prs = total_prs + excluded.total_prs,
+    total_commits = total_commits + excluded.total_commits,
+    total_lines = total_lines + excluded.total_lines,
+    points = points + excluded.points
+    """, (*params, history_day(time.time())))
+
+
+def score_users(client, logins, rules=None):
+    # Scores just these users into the leaderboard, counting PRs stored
+    # before they registered. Runs in the caller's transaction.
+    rules = rules or scoring_rules.current()
+    for chunk in _chunks(sorted(set(logins)), 400):
+        placeholders = ','.join('?' * len(chunk))
+        standings = rules.standings_query(f"users.github_user IN ({placeholders})")
+        params = tuple(chunk) * 2
+        _book_history(client, standings, params)
+        client.execute(f"""
+        INSERT INTO leaderboard (user_id, total_prs, total_commits, total_lines, points)
+        SELECT user_id, total_prs, total_commits, total_lines, points
+        FROM ({standings})
+        WHERE true
+        ON CONFLICT(user_id) DO UPDATE SET
+        total_prs = excluded.total_prs,
+        total_commits = excluded.total_commits,
+        total_lines = excluded.total_lines,
+        points = excluded.points
+        """, params)
+
+
+def _fill_shadow(client, rules, users_where, params):
+    # Scores the selected users into the shadow table and remembers the
+    # data_version each row was computed from
+    standings = rules.standings_query(users_where)
+    client.execute(f"""
+    INSERT OR REPLACE INTO leaderboard_shadow (user_id, total_prs, total_commits, total_lines, points)
+    SELECT user_id, total_prs, total_commits, total_lines, points
+    FROM ({standings})
+    """, params * 2)
+    client.execute(f"""
+    INSERT OR REPLACE INTO leaderboard_shadow_versions (user_id, data_version)
+    SELECT id, data_version FROM users WHERE {users_where}
+    """, params)
+    _book_history(client, standings, params * 2)
+
+
+def _leaderboard_schema(client):
+    table_sql = client.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'leaderboard'"
+    ).fetchone()[0]
+    index_sqls = [row[0] for row in client.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'leaderboard' AND sql IS NOT NULL"
+    )]
+    return table_sql, index_sqls
+
+
+def rebuild_leaderboard(client, rules=None, chunk_size=REBUILD_CHUNK_SIZE, pause=REBUILD_PAUSE):
+    # Full recompute without holding the write lock for its duration. Users
+    # are scored into leaderboard_shadow a chunk at a time, each chunk in its
+    # own short transaction, so webhook and registration writes interleave.
+    # The swap happens in a single transaction: users whose data changed
+    # while the chunks ran are rescored, then the shadow is renamed into
+    # place. Readers see either the old table or the new one, never a mix.
+    rules = rules or scoring_rules.current()
+
+    client.execute("BEGIN IMMEDIATE")
+    try:
+        started = client.execute("SELECT value FROM app_state WHERE key = ?", (REBUILD_LEASE_KEY,)).fetchone()
+        if started and time.time() - started[0] < REBUILD_LEASE:
+            client.rollback()
+            logging.warning("Another leaderboard rebuild is in progress. Skipping...")
+            return False
+        client.execute("""
+        INSERT INTO app_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (REBUILD_LEASE_KEY, time.time()))
+
+        table_sql, index_sqls = _leaderboard_schema(client)
+        client.execute("DROP TABLE IF EXISTS leaderboard_shadow")
+        client.execute("DROP TABLE IF EXISTS leaderboard_shadow_versions")
+        client.execute(re.sub(r'^CREATE TABLE\s+"?leaderboard"?', 'CREATE TABLE leaderboard_shadow', table_sql))
+        client.execute("CREATE TABLE leaderboard_shadow_versions (user_id INTEGER PRIMARY KEY, data_version INTEGER)")
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
+
+    try:
+        last_id = 0
+        chunks = 0
+        while True:
+            client.execute("BEGIN IMMEDIATE")
+            try:
+                ids = client.execute(
+                    "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, chunk_size)
+                ).fetchall()
+                if not ids:
+                    client.rollback()
+                    break
+                _fill_shadow(client, rules, "users.id BETWEEN ? AND ?", (last_id + 1, ids[-1][0]))
+                client.commit()
+            except Exception:
+                client.rollback()
+                raise
+            last_id = ids[-1][0]
+            chunks += 1
+            # Gives queued writers a turn at the lock
+            time.sleep(pause)
+
+        client.execute("BEGIN IMMEDIATE")
+        try:
+            # Catch up on users who registered or whose PRs changed since
+            # their chunk was scored
+            _fill_shadow(client, rules, """users.id IN (
+                SELECT users.id FROM users
+                LEFT JOIN leaderboard_shadow_versions v ON v.user_id = users.id
+                WHERE v.data_version IS NOT users.data_version
+            )""", ())
+            client.execute("DROP TABLE leaderboard")
+            client.execute("ALTER TABLE leaderboard_shadow RENAME TO leaderboard")
+            for index_sql in index_sqls:
+                client.execute(index_sql)
+            client.execute("DROP TABLE leaderboard_shadow_versions")
+            client.execute("DELETE FROM app_state WHERE key = ?", (REBUILD_LEASE_KEY,))
+            bump_leaderboard_version(client)
+            client.commit()
+        except Exception:
+            client.rollback()
+            raise
+    except Exception:
+        # Leaves the shadow for the next rebuild to drop; if even this fails
+        # the lease simply expires
+        try:
+            client.execute("DELETE FROM app_state WHERE key = ?", (REBUILD_LEASE_KEY,))
+            client.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to release leaderboard rebuild lease: {str(e)}")
+        raise
+
+    logging.info(f"Rebuilt leaderboard in {chunks} chunks.")
+    return True
+
+
+def score_diff(client, rules):
+    # Dry run: rescore every user with `rules` and list whose points or rank
+    # would move. Nothing is written.
+    rows = client.execute(f"""
+    WITH proposed AS (
+        SELECT user_id, points, DENSE_RANK() OVER (ORDER BY points DESC) AS rank
+        FROM ({rules.standings_query()})
+    ),
+    current AS (
+        SELECT users.id AS user_id, COALESCE(leaderboard.points, 0) AS points,
+               DENSE_RANK() OVER (ORDER BY COALESCE(leaderboard.points, 0) DESC) AS rank
+        FROM users
+        LEFT JOIN leaderboard ON leaderboard.user_id = users.id
+    )
+    SELECT users.github_user, current.points, proposed.points, current.rank, proposed.rank
+    FROM proposed
+    JOIN current ON current.user_id = proposed.user_id
+    JOIN users ON users.id = proposed.user_id
+    WHERE current.points != proposed.points OR current.rank != proposed.rank
+    ORDER BY proposed.rank, users.github_user
+    """).fetchall()
+    return [
+        {
+            'github_user': row[0], 'points': row[1], 'new_points': row[2],
+            'rank': row[3], 'new_rank': row[4],
+        }
+        for row in rows
+    ]
+
+
+def reconcile_leaderboard(client):
+    drifted = find_leaderboard_drift(client)
+    if drifted:
+        logging.warning(f"Leaderboard drift detected for {len(drifted)} users: {[row[0] for row in drifted]}")
+        rebuild_leaderboard(client)
+    else:
+        logging.info("Leaderboard is consistent with pull_requests.")
+    return len(drifted)
@@ -1,58 +1,93 @@
-from flask import Flask, jsonify, request, redirect, session, render_template,abort
+from flask import Blueprint, Flask, current_app, jsonify, request, redirect, session, render_template,abort, g
 from flask_cors import CORS
-from oauth import fetch_github_user, get_github_token
-from utils import calculate_leaderboard, fetch_user_repos, load_filter_list, update_leaderboard
+from oauth import fetch_github_user, get_github_token, oauth_deadline
+from utils import calculate_leaderboard, fetch_user_repos
+from allowlist import allowlist
+from leaderboard import (
+    history_day, leaderboard_around, leaderboard_snapshot, rank_changes, top_leaderboard, window_leaderboard,
+)
+from dashboard import load_dashboard
+from registrations import FORMATS, encode_rows, parse_users, registration_error
+from stream import stream_routes
+from webhooks import SUPPORTED_ACTIONS, enqueue_pr_event, verify_signature
 import db
+import metrics
 import logging
 import os
+import time
 from re import match 
+import binascii
+import csv
+import hmac
+import io
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from configs.globals import (
+    ADMIN_TOKEN, LEADERBOARD_RADIUS_DEFAULT, LEADERBOARD_RADIUS_MAX, LEADERBOARD_TOP_DEFAULT, LEADERBOARD_TOP_MAX, LEADERBOARD_WINDOW_MAX_DAYS,
+    LOG_LEVEL, METRICS_ENABLED, METRICS_TOKEN, USER_PRS_DEFAULT_LIMIT, USER_PRS_MAX_LIMIT,
+)
 from dotenv import load_dotenv
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app, supports_credentials=True)
-
-app.secret_key = os.getenv('SECRET_KEY', 'supersecretWOOOOOOOOOOOO')
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:5173/finish')
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
+
+routes = Blueprint('routes', __name__)
+
+def create_app():
+    app = Flask(__name__)
+    CORS(app, supports_credentials=True)
+    app.secret_key = os.getenv('SECRET_KEY', 'supersecretWOOOOOOOOOOOO')
+
+    metrics.init_app(app)
+    app.register_blueprint(routes)
+    app.register_blueprint(stream_routes)
+    app.teardown_appcontext(release_db)
 
-# Ensure DB connection is valid
-def ensure_db_connection():
-    logging.warning(f"db.client type before check: {type(db.client)}")
-    db.client = db.connect_db()
+    # Schema migrations run once at startup, before any request is accepted.
+    # Under gunicorn's preload this is the master process, so the connection
+    # used here is closed again rather than inherited by forked workers.
+    db.setup_database()
+    db.pool.close_all()
+    return app
 
-@app.before_request
-def init_db():
-    if not hasattr(app, 'db_initialized'):
-        db.setup_database()
-        app.db_initialized = True
+# One pooled connection per request, checked out lazily and returned on teardown
+def get_db():
+    if 'db' not in g:
+        g.db = db.pool.acquire()
+    return g.db
 
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db.pool.release(conn)
 
-@app.route('/callback')
+
+@routes.route('/callback')
 def callback():
     code = request.args.get('code')
     if not code:
         return jsonify({'error': 'Missing code parameter'}), 400
     try:
-        token = get_github_token(code)
+        # Token exchange and profile fetch share one bounded time budget
+        deadline = oauth_deadline()
+        token = get_github_token(code, deadline)
         try:
-            ensure_db_connection()
-            db.save_token(token)
+            db.save_token(get_db(), token)
         except Exception as e:
             return jsonify({'error': f"{e}"})
         
-        github_user = fetch_github_user(token)
-        logging.debug(f"GitHub user response: {github_user}")
+        github_user = fetch_github_user(token, deadline)
         info = [github_user['login'],github_user['avatar_url'],github_user['html_url']]
-        logging.info(info)
+        logging.info(f"OAuth login for {info[0]}")
         return redirect(f"{FRONTEND_URL}/finish/?login={info[0]}&avatar_url={info[1]}&html_url={info[2]}")
 
     except Exception as e:
         logging.error(f"OAuth callback error: {str(e)}")
         return redirect(f'{FRONTEND_URL}/')  # Retry OAuth flow
 
-@app.route('/register', methods=['POST'])
+@routes.route('/register', methods=['POST'])
 def submit_user():
     # Get data as json
     data = request.get_json()
@@ -69,22 +104,18 @@ def submit_user():
     link = str(user['html_url'])
     
     
-    logging.debug(f"Received: email={email}, phone={contact}, name={name}, token={user}")
+    logging.debug(f"Registration received for {github_user}")
     
     # Checking for validity
-    if len(contact) < 10:
-        return jsonify({'error': f"Invalid phone number. Received the number {contact}, which is not an valid Indian mobile number"})
-    
-    if not match(r'^\d{2}(cs|ct|ad|me|ce|ee|ec|cy)\d{3}@mgits\.ac\.in$', email):
-        return jsonify({'error': f"Invalid email. Received the email {email}, which is not an valid mgits email"})
+    error = registration_error(contact, email)
+    if error:
+        return jsonify({'error': error})
     
     # Adding user to the database
     try:
-        ensure_db_connection()
         if not github_user:
             raise Exception("Missing GitHub user or token in session.")
-        logging.warning(type(avatar))
-        db.save_user_to_db(github_user, name, email, contact, avatar, link)        
+        db.save_user_to_db(get_db(), github_user, name, email, contact, avatar, link)        
         
         return jsonify({'success': 'Request completed sucessfully'})
     
@@ -92,80 +123,113 @@ def submit_user():
         return jsonify({'error': f"{e}"})
         
         
-@app.route('/dashboard')
+@routes.route('/dashboard')
 def dashboard():
     github_user = session.get('github_id') 
 
     try:
-        user = db.client.execute(
-            "SELECT * FROM users WHERE github_user = ?",
-            (github_user,)
-        ).fetchone()
-
-        if not user:
+        body = load_dashboard(get_db(), github_user)
+        if body is None:
             return jsonify({'error': 'User not found'}), 404
-    
-        # Fetch repos directly from pull requests table
-        pr_repos = db.client.execute("""
-        SELECT DISTINCT repo_name FROM pull_requests WHERE github_user = ?
-        """, (github_user,)).fetchall()
-
-        # Fetch allowed repos from filter.txt
-        allowed_repos = load_filter_list()
-        allowed_repo_names = {repo.split('/')[-1] for repo in allowed_repos}
-
-        # Filter PR repos based on allowed repos
-        filtered_repos = [
-            {'repo_name': repo[0]}
-            for repo in pr_repos
-            if repo[0].split('/')[-1] in allowed_repo_names
-        ]
-
-        user_prs = db.client.execute("""
-        SELECT repo_name, status, id
-        FROM pull_requests
-        WHERE github_user = ?
-        """, (github_user,)).fetchall()
-
-        pr_list = [
-            {
-                'repo_name': pr[0],
-                'status': pr[1],
-                'pr_id': pr[2]
-            }
-            for pr in user_prs
-        ]
-
-        user_data = {
-            'SOCid': user[0],
-            'username': user[1],
-            'email': user[3],
-            'contributed_repos': filtered_repos,
-            'pull_requests': pr_list
-        }
-
-        return jsonify({'user': user_data})
+
+        return current_app.response_class(body, mimetype='application/json')
 
     except Exception as e:
         logging.error(f"Failed to fetch dashboard: {str(e)}")
         return jsonify({'error': 'Failed to load dashboard'}), 500
 
-@app.route('/leaderboard')
+@routes.route('/leaderboard')
 def leaderboard():
-    ensure_db_connection()
-    leaderboard_data = db.client.execute("""
-    SELECT users.name, leaderboard.total_prs,leaderboard.points
-    FROM leaderboard
-    JOIN users ON leaderboard.user_id = users.id
-    ORDER BY leaderboard.total_prs DESC
-    """).fetchall()
+    if request.args.get('window'):
+        return leaderboard_window()
+
+    version, body = leaderboard_snapshot(get_db())
+
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(f"leaderboard-{version}")
+    return response.make_conditional(request)
+
+def parse_days(value):
+    # Windows are whole days, written like 7d
+    found = match(r'^(\d+)d$', value or '')
+    if not found or not 1 <= int(found.group(1)) <= LEADERBOARD_WINDOW_MAX_DAYS:
+        raise ValueError(f"Invalid window {value}")
+    return int(found.group(1))
+
+def leaderboard_window():
+    try:
+        days = parse_days(request.args.get('window'))
+        limit = int(request.args.get('limit', LEADERBOARD_TOP_DEFAULT))
+    except ValueError:
+        return jsonify({'error': 'Invalid window or limit'}), 400
+    limit = max(1, min(limit, LEADERBOARD_TOP_MAX))
+
+    version, body = window_leaderboard(get_db(), days, limit)
+    response = current_app.response_class(body, mimetype='application/json')
+    # Windows slide at midnight UTC without the version moving
+    response.set_etag(f"leaderboard-window-{days}-{limit}-{version}-{history_day(time.time())}")
+    return response.make_conditional(request)
+
+@routes.route('/leaderboard/changes')
+def leaderboard_changes():
+    try:
+        days = parse_days(request.args.get('since', '1d'))
+        limit = int(request.args.get('limit', LEADERBOARD_TOP_MAX))
+    except ValueError:
+        return jsonify({'error': 'Invalid since or limit'}), 400
+    limit = max(1, min(limit, LEADERBOARD_TOP_MAX))
+
+    version, body = rank_changes(get_db(), days, limit)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(f"leaderboard-changes-{days}-{limit}-{version}-{history_day(time.time())}")
+    return response.make_conditional(request)
+
+@routes.route('/leaderboard/top')
+def leaderboard_top():
+    try:
+        limit = int(request.args.get('limit', LEADERBOARD_TOP_DEFAULT))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    limit = max(1, min(limit, LEADERBOARD_TOP_MAX))
+
+    version, body = top_leaderboard(get_db(), limit)
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(f"leaderboard-top-{limit}-{version}")
+    return response.make_conditional(request)
+
+@routes.route('/leaderboard/around/<github_user>')
+def leaderboard_around_user(github_user):
+    try:
+        radius = int(request.args.get('radius', LEADERBOARD_RADIUS_DEFAULT))
+    except ValueError:
+        return jsonify({'error': 'Invalid radius'}), 400
+    radius = max(0, min(radius, LEADERBOARD_RADIUS_MAX))
 
-    return jsonify({'leaderboard': leaderboard_data})
+    version, body = leaderboard_around(get_db(), github_user, radius)
+    if body is None:
+        return jsonify({'error': 'User not on the leaderboard'}), 404
 
-@app.route('/webhook', methods=['POST'])
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(f"leaderboard-around-{github_user}-{radius}-{version}")
+    return response.make_conditional(request)
+
+@routes.route('/webhook', methods=['POST'])
 def github_webhook():
-    payload = request.json
+    body = request.get_data(cache=False)
+    if not verify_signature(body, request.headers.get('X-Hub-Signature-256')):
+        return jsonify({'error': 'Invalid signature'}), 401
+
+    # Everything but pull request events is acknowledged before parsing
     event = request.headers.get('X-GitHub-Event', '')
+    if event == 'ping':
+        return jsonify({'status': 'pong'})
+    if event and event != 'pull_request':
+        return jsonify({'status': 'ignored'})
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        abort(400)
 
     if not payload or 'pull_request' not in payload:
         abort(400)
@@ -173,47 +237,127 @@ def github_webhook():
     pr = payload['pull_request']
     action = payload.get('action')
 
-    if action in ['opened', 'synchronize', 'closed']:
-        repo = payload['repository']['full_name']
-        github_login = pr['user']['login']
-        pr_id = pr['id']
-        commits = pr['commits']
-        additions = pr['additions']
-        deletions = pr['deletions']
-        status = 'merged' if pr.get('merged', False) else pr['state']
-
-        ensure_db_connection()
-        db.client.execute("""
-        INSERT INTO pull_requests (pr_id, repo_name, github_login, total_commits, total_lines, status)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ON CONFLICT(pr_id) DO UPDATE SET
-        total_commits = excluded.total_commits,
-        total_lines = excluded.total_lines,
-        status = excluded.status
-        """, (pr_id, repo, github_login, commits, additions - deletions, status))
-
-        db.client.commit()
-        update_leaderboard(db.client)
-
-    return jsonify({'status': 'ok'})
-
-@app.route('/api/user/<github_id>/prs')
+    if action not in SUPPORTED_ACTIONS:
+        return jsonify({'status': 'ignored'})
+
+    repo = payload['repository']['full_name']
+    # Events for repos outside the event are dropped before any write
+    if not allowlist.is_tracked(repo):
+        return jsonify({'status': 'ignored'})
+
+    github_login = pr['user']['login']
+    pr_id = pr['id']
+    commits = pr['commits']
+    additions = pr['additions']
+    deletions = pr['deletions']
+    status = 'merged' if pr.get('merged', False) else pr['state']
+
+    # Applied by the webhook worker so GitHub gets its answer right away
+    queued = enqueue_pr_event(
+        get_db(), pr_id, repo, github_login, commits, additions - deletions, status,
+        delivery_id=request.headers.get('X-GitHub-Delivery')
+    )
+    if not queued:
+        return jsonify({'status': 'duplicate'})
+    return jsonify({'status': 'queued'}), 202
+
+@routes.route('/api/user/<github_id>/prs')
 def user_prs(github_id):
-    limit = request.args.get('limit', 10)
-    offset = request.args.get('offset', 0)
-    user_prs = db.client.execute("""
+    try:
+        limit = int(request.args.get('limit', USER_PRS_DEFAULT_LIMIT))
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    limit = max(1, min(limit, USER_PRS_MAX_LIMIT))
+
+    # Keyset pagination on pr_id: each page is an index range scan that starts
+    # right after the previous one, no matter how deep the client pages.
+    user_prs = get_db().execute("""
     SELECT pr_id, repo_name, total_commits, total_lines, status
     FROM pull_requests
-    WHERE github_login = ?
-    LIMIT ? OFFSET ?
-    """, (github_id, limit, offset)).fetchall()
+    WHERE github_login = ? AND pr_id > ?
+    ORDER BY pr_id
+    LIMIT ?
+    """, (github_id, after, limit + 1)).fetchall()
 
-    if not user_prs:
+    if not user_prs and not after:
         return jsonify({'message': 'No PRs found'}), 404
 
+    has_more = len(user_prs) > limit
+    user_prs = user_prs[:limit]
+    next_cursor = encode_cursor(user_prs[-1][0]) if has_more else None
+
     pr_list = [{'pr_id': pr[0], 'repo': pr[1], 'commits': pr[2], 'lines': pr[3], 'status': pr[4]} for pr in user_prs]
-    return jsonify({'prs': pr_list})
+    return jsonify({'prs': pr_list, 'next_cursor': next_cursor})
 
+def encode_cursor(pr_id):
+    return urlsafe_b64encode(f"pr:{pr_id}".encode()).decode().rstrip('=')
 
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        decoded = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(f"Malformed cursor {cursor}")
+    prefix, _, pr_id = decoded.partition(':')
+    if prefix != 'pr':
+        raise ValueError(f"Malformed cursor {cursor}")
+    return int(pr_id)
+
+def require_bearer(token):
+    # Endpoints guarded by a token do not exist unless it is configured
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode('utf-8'), f"Bearer {token}".encode('utf-8')):
+        abort(401)
+
+def require_admin():
+    require_bearer(ADMIN_TOKEN)
+
+@routes.route('/admin/users/import', methods=['POST'])
+def import_users():
+    require_admin()
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+
+    # Parsed straight off the request stream; utf-8-sig drops the BOM
+    # spreadsheet exports start with
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+    try:
+        users, errors = parse_users(stream, fmt, db.get_registered_logins(get_db()))
+    except (ValueError, csv.Error) as e:
+        return jsonify({'error': f"{e}"}), 400
+    if errors:
+        return jsonify({'error': f"{len(errors)} invalid rows, nothing was imported", 'rows': errors[:100]}), 400
+
+    db.save_users_to_db(get_db(), users)
+    logging.info(f"Imported {len(users)} users.")
+    return jsonify({'success': 'Request completed sucessfully', 'imported': len(users)})
+
+@routes.route('/admin/export/<kind>')
+def export_table(kind):
+    require_admin()
+    if kind not in db.EXPORTS:
+        return jsonify({'error': f"Unknown export {kind}"}), 404
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in FORMATS:
+        return jsonify({'error': f"Unknown format {fmt}"}), 400
+
+    return current_app.response_class(
+        encode_rows(db.export_rows(kind), fmt),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f"attachment; filename={kind}.{fmt}"},
+    )
+
+@routes.route('/metrics')
+def metrics_endpoint():
+    if not METRICS_ENABLED:
+        abort(404)
+    require_bearer(METRICS_TOKEN)
+    return current_app.response_class(metrics.render(get_db()), mimetype='text/plain; version=0.0.4')
+
+
+# Development server only; production runs gunicorn -c gunicorn.conf.py
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    create_app().run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
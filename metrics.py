@@ -0,0 +1,353 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from configs.globals import LOG_LEVEL, METRICS_ENABLED, METRICS_FLUSH_INTERVAL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Latency buckets in seconds, from a cached snapshot up to a slow GitHub call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+# Values written by other processes (the cron worker) are stored in app_state
+# under this prefix and exposed as gauges by whichever process is scraped.
+SHARED_PREFIX = 'metric:'
+
+# Every gunicorn worker keeps its own registry. Each one publishes it to
+# metric_snapshots every METRICS_FLUSH_INTERVAL, and the scraped process
+# merges those with its live values, so a scrape sees the whole
+# deployment whichever worker answers it. A worker that exits folds its
+# counters into this row so the totals never go backwards.
+RETIRED = 'retired'
+# Gauges from a snapshot this many flushes old are from a dead process
+STALE_FLUSHES = 4
+
+_registry = []
+_collectors = []
+_process = {'worker': None}
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        # Counts are kept per bucket and only made cumulative when rendered
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+
+        samples = []
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket
+                samples.append((f"{self.name}_bucket", dict(labels, le=str(bound)), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+def register_collector(collector):
+    # collector() returns (name, type, help, [(labels, value), ...]) tuples and
+    # is only called at scrape time, so it costs nothing between scrapes
+    _collectors.append(collector)
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'pullranker_http_request_duration_seconds', 'Time spent handling a request.',
+    labels=('method', 'route', 'status'),
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    'pullranker_db_queries_per_request', 'SQLite statements executed per request.',
+    labels=('route',), buckets=COUNT_BUCKETS,
+)
+DB_SECONDS_PER_REQUEST = Histogram(
+    'pullranker_db_seconds_per_request', 'Time spent in SQLite per request.',
+    labels=('route',),
+)
+DB_QUERIES = Counter('pullranker_db_queries_total', 'SQLite statements executed.')
+GITHUB_REQUESTS = Counter(
+    'pullranker_github_requests_total', 'GitHub API requests by response status.',
+    labels=('status',),
+)
+GITHUB_REQUEST_SECONDS = Histogram('pullranker_github_request_duration_seconds', 'GitHub API request latency.')
+
+
+# Per-thread tally of the statements run while serving the current request
+_request = threading.local()
+
+
+def _record_query(started):
+    elapsed = time.perf_counter() - started
+    DB_QUERIES.inc()
+    if getattr(_request, 'active', False):
+        _request.queries += 1
+        _request.db_seconds += elapsed
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Times the statement up to its first row; rows fetched later are not
+    # counted, which is fine for the point lookups the request paths run.
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_query(started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_query(started)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute creates its cursor internally, so it is overridden
+    # here rather than relying on cursor() alone
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def connection_factory():
+    # Plain connections when metrics are off, so the query path is untouched
+    return TimedConnection if METRICS_ENABLED else sqlite3.Connection
+
+
+def observe_github_request(status, elapsed):
+    if METRICS_ENABLED:
+        GITHUB_REQUESTS.inc(str(status))
+        GITHUB_REQUEST_SECONDS.observe(elapsed)
+
+
+def init_app(app):
+    if not METRICS_ENABLED:
+        return
+
+    from flask import request
+
+    @app.before_request
+    def start_request_timer():
+        _request.active = True
+        _request.queries = 0
+        _request.db_seconds = 0.0
+        _request.started = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        if getattr(_request, 'active', False):
+            _request.active = False
+            # The rule, not the path, so /api/user/<github_id>/prs is one series
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - _request.started, request.method, route, str(response.status_code)
+            )
+            DB_QUERIES_PER_REQUEST.observe(_request.queries, route)
+            DB_SECONDS_PER_REQUEST.observe(_request.db_seconds, route)
+        return response
+
+
+def record_shared(client, values):
+    # Gauges the cron worker reports about its last cycle
+    if not METRICS_ENABLED:
+        return
+    client.executemany("""
+    INSERT INTO app_state (key, value) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, [(SHARED_PREFIX + name, value) for name, value in values.items()])
+    client.commit()
+
+
+def _worker_id():
+    if _process['worker'] is None:
+        _process['worker'] = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    return _process['worker']
+
+
+def after_fork():
+    # Values counted in the preloading master (the migrations' queries)
+    # would otherwise be reported again by every worker
+    for metric in _registry:
+        metric.reset()
+    _process['worker'] = None
+
+
+def _families():
+    # This process's values as [name, type, help, [[sample, labels, value], ...]]
+    families = []
+    for metric in _registry:
+        kind = 'histogram' if isinstance(metric, Histogram) else 'counter'
+        families.append([metric.name, kind, metric.help, [list(sample) for sample in metric.samples()]])
+    for collector in _collectors:
+        for name, kind, help, samples in collector():
+            families.append([name, kind, help, [[name, labels, value] for labels, value in samples]])
+    return families
+
+
+def _merge(snapshots):
+    # Counters and histograms add up across processes. Gauges are each
+    # process's view of shared state (e.g. the token pool), so the largest
+    # is reported rather than a sum.
+    merged = {}
+    for families in snapshots:
+        for name, kind, help, samples in families:
+            values = merged.setdefault(name, (kind, help, {}))[2]
+            for sample, labels, value in samples:
+                key = (sample, tuple(sorted(labels.items())))
+                if kind == 'gauge' and key in values:
+                    values[key] = max(values[key], value)
+                else:
+                    values[key] = values.get(key, 0) + value
+    return [
+        [name, kind, help, [[sample, dict(labels), value] for (sample, labels), value in values.items()]]
+        for name, (kind, help, values) in merged.items()
+    ]
+
+
+def _save(client, worker, families):
+    client.execute("""
+    INSERT INTO metric_snapshots (worker, families, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT(worker) DO UPDATE SET
+    families = excluded.families,
+    updated_at = excluded.updated_at
+    """, (worker, json.dumps(families, separators=(',', ':')), time.time()))
+
+
+def flush(client):
+    if not METRICS_ENABLED:
+        return
+    _save(client, _worker_id(), _families())
+    client.commit()
+
+
+def retire(client):
+    # Called as a process exits: its counters move into the retired row
+    # and its own snapshot is removed, in one transaction
+    if not METRICS_ENABLED:
+        return
+    client.execute("BEGIN IMMEDIATE")
+    try:
+        row = client.execute("SELECT families FROM metric_snapshots WHERE worker = ?", (RETIRED,)).fetchone()
+        mine = [family for family in _families() if family[1] != 'gauge']
+        _save(client, RETIRED, _merge(([json.loads(row[0])] if row else []) + [mine]))
+        client.execute("DELETE FROM metric_snapshots WHERE worker = ?", (_worker_id(),))
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
+
+
+def _flush_loop():
+    # Imported here: db depends on this module for its connection factory
+    import db
+
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            with db.pool.connection() as client:
+                flush(client)
+        except Exception as e:
+            logging.error(f"Failed to publish metrics: {str(e)}")
+
+
+def start_flusher():
+    # Started per gunicorn worker from post_fork
+    if METRICS_ENABLED:
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(name, labels, value):
+    if labels:
+        rendered = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+        return f"{name}{{{rendered}}} {value}"
+    return f"{name} {value}"
+
+
+def render(client):
+    # Prometheus text exposition format, version 0.0.4
+    stale_before = time.time() - STALE_FLUSHES * METRICS_FLUSH_INTERVAL
+    snapshots = [_families()]
+    for families, updated_at in client.execute(
+        "SELECT families, updated_at FROM metric_snapshots WHERE worker != ?", (_worker_id(),)
+    ):
+        families = json.loads(families)
+        if updated_at < stale_before:
+            families = [family for family in families if family[1] != 'gauge']
+        snapshots.append(families)
+
+    lines = []
+    for name, kind, help, samples in _merge(snapshots):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(_format(sample, labels, value) for sample, labels, value in samples)
+
+    for key, value in client.execute(
+        "SELECT key, value FROM app_state WHERE key >= ? AND key < ? ORDER BY key",
+        (SHARED_PREFIX, SHARED_PREFIX[:-1] + chr(ord(SHARED_PREFIX[-1]) + 1))
+    ):
+        name = f"pullranker_{key[len(SHARED_PREFIX):]}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(_format(name, {}, value))
+
+    return '\n'.join(lines) + '\n'
@@ -1,8 +1,10 @@
 import requests
 import os
+import time
 from dotenv import load_dotenv
 import logging
-import time
+from configs.globals import OAUTH_TIMEOUT
+from github import github_get, is_rate_limited, session
 load_dotenv()
 
 CLIENT_ID = os.getenv('GITHUB_CLIENT_ID')
@@ -10,36 +12,37 @@ CLIENT_SECRET = os.getenv('GITHUB_CLIENT_SECRET')
 REDIRECT_URI = os.getenv('REDIRECT_URI', 'http://localhost:5000/callback')
 
 
-def fetch_github_user(token=None) :
-    max_attempts=3
-    attempts =0
-    while attempts<max_attempts:
-        headers= {'Authorization': f'token {token}'}   #Auth headers, to be used in request, geenrally used in axios, can include cookies for extra auth, remember if https
+def oauth_deadline(budget=OAUTH_TIMEOUT):
+    # One budget covers every GitHub call made while serving a login
+    return time.monotonic() + budget
 
-        try:
-            response = requests.get("https://api.github.com/user", headers=headers)
-            response.raise_for_status()  # Raises exception for 4xx or 5xx responses
-            return response.json()  # Return GitHub user info
-        
-        except requests.exceptions.HTTPError as e:
-            # Handle rate limit (403) by rotating the token
-            if response.status_code == 403:
-                logging.error(f"Token {token} hit rate limit. Rotating...")
-                token = None  # Force token refresh
-            else:
-                # Log the error and re-raise it for higher-level handling
-                logging.error(f"Failed to fetch GitHub user: {response.text}")
-                raise e
-        
-        attempts += 1
-        time.sleep(min(60 * attempts, 300))  # Exponential backoff (up to 5 mins)
+def _remaining(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise Exception("Timed out talking to GitHub. Please try again.")
+    return remaining
 
-    
-    # Raise exception if no valid tokens are left after attempts
-    raise Exception("All available tokens hit the rate limit.")
+def fetch_github_user(token, deadline=None):
+    deadline = deadline or oauth_deadline()
+    # /user has to be fetched with the user's own token, so there is nothing
+    # to rotate to; a rate-limited token fails fast instead of sleeping.
+    response = github_get("user", token=token, timeout=_remaining(deadline))
+    if is_rate_limited(response):
+        logging.error("User token hit the GitHub rate limit.")
+        raise Exception("GitHub rate limit reached for this token. Please try again later.")
+
+    try:
+        response.raise_for_status()  # Raises exception for 4xx or 5xx responses
+    except requests.exceptions.HTTPError as e:
+        logging.error(f"Failed to fetch GitHub user: {response.status_code}")
+        raise e
+
+    return response.json()  # Return GitHub user info
 
-def get_github_token(code):
-    response = requests.post(
+def get_github_token(code, deadline=None):
+    deadline = deadline or oauth_deadline()
+    # Same keep-alive session as the API calls, bounded by the login's budget
+    response = session.post(
         "https://github.com/login/oauth/access_token",
         data={
             'client_id': CLIENT_ID,
@@ -48,6 +51,7 @@ def get_github_token(code):
             'redirect_uri': REDIRECT_URI,
         },
         headers={'Accept': 'application/json'},
+        timeout=_remaining(deadline),
     )
 
     # Handle potential non-JSON responses gracefully
@@ -60,7 +64,7 @@ def get_github_token(code):
     # Handle OAuth error case
     if 'access_token' not in data:
         error_message = data.get('error_description', data.get('error', 'Unknown error during token exchange'))
-        logging.error(f"GitHub token exchange failed: {data}")
+        logging.error(f"GitHub token exchange failed: {data.get('error')}")
         raise Exception(f"Failed to retrieve access token from GitHub: {error_message}")
     
     return data['access_token']
@@ -0,0 +1,124 @@
+import csv
+import io
+import json
+import logging
+import re
+
+from configs.globals import IMPORT_MAX_ROWS, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL)
+
+EMAIL_PATTERN = re.compile(r'^\d{2}(cs|ct|ad|me|ce|ee|ec|cy)\d{3}@mgits\.ac\.in$')
+
+# Columns of a bulk import, in the order save_users_to_db takes them
+USER_FIELDS = ('github_user', 'name', 'email', 'contact', 'avatar', 'link')
+REQUIRED_FIELDS = ('github_user', 'name', 'email', 'contact')
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+# Bytes an encoder buffers before handing a chunk to the response
+CHUNK_SIZE = 64 * 1024
+
+
+def registration_error(contact, email):
+    # The checks /register applies; returns None for a valid registration
+    if len(contact) < 10:
+        return f"Invalid phone number. Received the number {contact}, which is not an valid Indian mobile number"
+    if not EMAIL_PATTERN.match(email):
+        return f"Invalid email. Received the email {email}, which is not an valid mgits email"
+    return None
+
+
+def _records(stream, fmt):
+    # Yields (line, record) from a CSV with a header row or from JSONL
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                yield line, None
+                continue
+            yield line, record if isinstance(record, dict) else None
+
+
+def parse_users(stream, fmt, registered=None):
+    # Reads a whole import and returns (users, errors). Every row is
+    # validated before anything is written, so a file with errors can be
+    # fixed and resent as a whole. registered maps lowercased logins to
+    # the users table's spelling.
+    registered = registered or {}
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {sorted(FORMATS)}")
+
+    users, errors, seen = [], [], {}
+    for line, record in _records(stream, fmt):
+        if len(users) + len(errors) >= IMPORT_MAX_ROWS:
+            raise ValueError(f"Import is limited to {IMPORT_MAX_ROWS} users.")
+        if record is None:
+            errors.append({'line': line, 'error': 'Malformed row'})
+            continue
+
+        row = {field: str(record.get(field) or '').strip() for field in USER_FIELDS}
+        missing = [field for field in REQUIRED_FIELDS if not row[field]]
+        if missing:
+            errors.append({'line': line, 'error': f"Missing {', '.join(missing)}"})
+            continue
+        error = registration_error(row['contact'], row['email'])
+        if error:
+            errors.append({'line': line, 'github_user': row['github_user'], 'error': error})
+            continue
+        # GitHub logins are case-insensitive, so one user cannot appear twice
+        login = row['github_user'].lower()
+        if login in seen:
+            errors.append({'line': line, 'github_user': row['github_user'], 'error': f"Duplicate of line {seen[login]}"})
+            continue
+        # users.github_user is case-sensitive like PR matching, so a login
+        # differing only in case would become a second user
+        if registered.get(login, row['github_user']) != row['github_user']:
+            errors.append({
+                'line': line, 'github_user': row['github_user'],
+                'error': f"Already registered as {registered[login]}",
+            })
+            continue
+        seen[login] = line
+        users.append(tuple(row[field] or None for field in USER_FIELDS))
+    return users, errors
+
+
+def _chunked(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _csv_lines(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    for row in rows:
+        writer.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+def _jsonl_lines(rows):
+    columns = next(rows, None)
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), separators=(',', ':')) + '\n'
+
+
+def encode_rows(rows, fmt):
+    # rows is db.export_rows' output: column names first, then the rows
+    lines = _csv_lines(rows) if fmt == 'csv' else _jsonl_lines(rows)
+    return _chunked(lines)
@@ -0,0 +1,70 @@
+# Manage per-repo config in tracked_repos.
+#
+#   python repos.py list
+#   python repos.py set owner/name --weight 2 --from 2024-10-01T00:00:00Z --until 2024-11-01T00:00:00Z
+#   python repos.py remove owner/name
+#
+# Running processes pick the change up within ALLOWLIST_REFRESH_INTERVAL.
+# A weight change rescores the leaderboard right away.
+import argparse
+import calendar
+import json
+import time
+
+import db
+from allowlist import remove_repo_config, set_repo_config
+from leaderboard import reconcile_leaderboard
+
+
+def parse_time(value):
+    # Same ISO 8601 UTC form GitHub uses, e.g. 2024-10-01T12:34:56Z
+    try:
+        return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DDTHH:MM:SSZ, got {value!r}")
+
+
+def format_time(value):
+    return None if value is None else time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(value))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage per-repo config in tracked_repos.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='show tracked_repos')
+    set_parser = commands.add_parser('set', help='add a repo or replace its config')
+    set_parser.add_argument('repo_name', help='owner/name')
+    set_parser.add_argument('--weight', type=float, default=1.0, help='points multiplier (default 1)')
+    set_parser.add_argument('--from', dest='active_from', type=parse_time, help='first moment PRs count')
+    set_parser.add_argument('--until', dest='active_until', type=parse_time, help='moment PRs stop counting')
+    remove_parser = commands.add_parser('remove', help='drop a repo from tracked_repos')
+    remove_parser.add_argument('repo_name', help='owner/name')
+    args = parser.parse_args()
+
+    if args.command == 'set' and args.weight < 0:
+        parser.error('--weight must be non-negative')
+
+    db.setup_database()
+    with db.pool.connection() as client:
+        if args.command == 'set':
+            set_repo_config(client, args.repo_name, args.weight, args.active_from, args.active_until)
+        elif args.command == 'remove':
+            remove_repo_config(client, args.repo_name)
+        if args.command != 'list':
+            # Weights are part of every PR's points
+            reconcile_leaderboard(client)
+
+        rows = client.execute(
+            "SELECT repo_name, weight, active_from, active_until FROM tracked_repos ORDER BY repo_name"
+        ).fetchall()
+        print(json.dumps([
+            {
+                'repo_name': row[0], 'weight': row[1],
+                'active_from': format_time(row[2]), 'active_until': format_time(row[3]),
+            }
+            for row in rows
+        ], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# Preview or apply a change to the scoring rules.
+#
+#   python rescore.py candidate.json           # dry run: diff against current standings
+#   python rescore.py candidate.json --apply   # install as scoring.json and recompute
+#
+# Running processes pick up the new scoring.json by its mtime; the cron
+# worker recomputes on its own as well, --apply just does it right away.
+import argparse
+import json
+import os
+import shutil
+
+import db
+from configs.globals import SCORING_PATH
+from leaderboard import rebuild_leaderboard, score_diff
+from scoring import load_rules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Preview or apply a change to the scoring rules.')
+    parser.add_argument('rules', nargs='?', default=SCORING_PATH, help='candidate rules (JSON)')
+    parser.add_argument('--apply', action='store_true', help='install the rules and recompute the leaderboard')
+    args = parser.parse_args()
+
+    # A candidate that would not load is never installed
+    try:
+        rules = load_rules(args.rules)
+    except (ValueError, OSError) as e:
+        parser.error(f"invalid rules {args.rules}: {e}")
+    db.setup_database()
+    with db.pool.connection() as client:
+        changes = score_diff(client, rules)
+        print(json.dumps({'rules': rules.config(), 'users_affected': len(changes), 'changes': changes}, indent=2))
+
+        if args.apply:
+            if os.path.abspath(args.rules) != os.path.abspath(SCORING_PATH):
+                # Written next to the target first so the swap is atomic
+                shutil.copyfile(args.rules, SCORING_PATH + '.tmp')
+                os.replace(SCORING_PATH + '.tmp', SCORING_PATH)
+            rebuild_leaderboard(client, rules)
+
+
+if __name__ == '__main__':
+    main()
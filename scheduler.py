@@ -0,0 +1,106 @@
+import logging
+import time
+
+from configs.globals import (
+    LOG_LEVEL, SCHEDULER_DEFAULT_INTERVAL, SCHEDULER_MAX_INTERVAL, SCHEDULER_MIN_INTERVAL, SCHEDULER_WEBHOOK_GRACE,
+)
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Each repo is polled on its own interval: halved after a poll that found
+# PR activity, grown by half after a quiet one, within the configured bounds.
+# State lives in repo_schedule so a restarted worker keeps its cadence.
+SPEEDUP = 0.5
+SLOWDOWN = 1.5
+
+
+def _schedule(client, repos):
+    placeholders = ','.join('?' * len(repos))
+    rows = client.execute(f"""
+    SELECT repo_name, next_due_at, interval, last_polled_at, webhook_at
+    FROM repo_schedule
+    WHERE repo_name IN ({placeholders})
+    """, repos).fetchall()
+    return {row[0].lower(): row[1:] for row in rows}
+
+
+def due_repos(client, repos, now=None):
+    # Returns (due, skipped). A repo webhooks refreshed within the grace
+    # period is pushed back a full interval instead of being polled, but
+    # never past SCHEDULER_MAX_INTERVAL since its last real poll.
+    if not repos:
+        return [], []
+    now = time.time() if now is None else now
+    schedule = _schedule(client, repos)
+
+    due, skipped = [], []
+    for repo in repos:
+        if repo.lower() not in schedule:
+            due.append(repo)
+            continue
+        next_due_at, interval, last_polled_at, webhook_at = schedule[repo.lower()]
+        if next_due_at > now:
+            continue
+        recently_pushed = webhook_at and now - webhook_at < SCHEDULER_WEBHOOK_GRACE
+        overdue = not last_polled_at or now - last_polled_at >= SCHEDULER_MAX_INTERVAL
+        if recently_pushed and not overdue:
+            skipped.append(repo)
+        else:
+            due.append(repo)
+
+    if skipped:
+        client.executemany("""
+        UPDATE repo_schedule SET next_due_at = ? + interval WHERE repo_name = ?
+        """, [(now, repo) for repo in skipped])
+        client.commit()
+    return due, skipped
+
+
+def record_polls(client, activity, now=None):
+    # activity maps repo -> whether the poll saw any PR updated since the last
+    now = time.time() if now is None else now
+    schedule = _schedule(client, list(activity)) if activity else {}
+
+    rows = []
+    for repo, active in activity.items():
+        interval = schedule[repo.lower()][1] if repo.lower() in schedule else SCHEDULER_DEFAULT_INTERVAL
+        interval *= SPEEDUP if active else SLOWDOWN
+        interval = max(SCHEDULER_MIN_INTERVAL, min(SCHEDULER_MAX_INTERVAL, interval))
+        rows.append((repo, now + interval, interval, now))
+
+    client.executemany("""
+    INSERT INTO repo_schedule (repo_name, next_due_at, interval, last_polled_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(repo_name) DO UPDATE SET
+    next_due_at = excluded.next_due_at,
+    interval = excluded.interval,
+    last_polled_at = excluded.last_polled_at
+    """, rows)
+    client.commit()
+
+
+def note_webhook_activity(client, repos, at=None):
+    # Called inside the outbox drain's transaction; committed by the caller
+    at = time.time() if at is None else at
+    client.executemany("""
+    INSERT INTO repo_schedule (repo_name, next_due_at, interval, webhook_at)
+    VALUES (?, 0, ?, ?)
+    ON CONFLICT(repo_name) DO UPDATE SET webhook_at = excluded.webhook_at
+    """, [(repo, SCHEDULER_DEFAULT_INTERVAL, at) for repo in repos])
+
+
+def watermarks(client):
+    # A repo's watermark moves whenever any of its PRs was updated, so
+    # comparing it around a poll tells whether the repo saw activity
+    return dict(client.execute("SELECT repo_name, last_updated_at FROM repo_sync_state"))
+
+
+def next_wakeup(client, repos, now=None):
+    # Seconds until the earliest repo falls due
+    now = time.time() if now is None else now
+    if not repos:
+        return SCHEDULER_MAX_INTERVAL
+    schedule = _schedule(client, repos)
+    if len(schedule) < len(repos):
+        return 0
+    return max(0, min(row[0] for row in schedule.values()) - now)
@@ -0,0 +1,166 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+from configs.globals import LOG_LEVEL, SCORING_PATH
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# The rules the event started with; scoring.json only needs the keys it changes
+DEFAULT_RULES = {
+    # Points for the PR that counts towards a (repo, user) pair, by status
+    'status_points': {'merged': 10},
+    'default_points': 5,
+    # Multiply points by the repo's weight from tracked_repos (1 if unset)
+    'repo_weights': True,
+    # Most commits / lines a single PR adds to a user's totals (null: no cap)
+    'commit_cap': None,
+    'line_cap': None,
+}
+
+_STATUS = re.compile(r'^[a-z_]+$')
+
+
+class ScoringRules:
+    # Rules are compiled into SQL expressions over a pull_requests row and
+    # its tracked_repos row, so standings for every user come out of one
+    # set-based statement and the incremental path scores PRs identically.
+
+    def __init__(self, config=None):
+        if config is not None and not isinstance(config, dict):
+            raise ValueError("Scoring rules must be a JSON object")
+        config = dict(DEFAULT_RULES, **(config or {}))
+        unknown = set(config) - set(DEFAULT_RULES)
+        if unknown:
+            raise ValueError(f"Unknown scoring settings: {sorted(unknown)}")
+        if not isinstance(config['status_points'], dict):
+            raise ValueError("status_points must be an object of status -> points")
+        if not isinstance(config['repo_weights'], bool):
+            raise ValueError("repo_weights must be true or false")
+
+        self.status_points = {}
+        for status, points in config['status_points'].items():
+            if not _STATUS.match(status):
+                raise ValueError(f"Invalid status {status!r}")
+            self.status_points[status] = self._number(points, f"status_points.{status}")
+        self.default_points = self._number(config['default_points'], 'default_points')
+        self.repo_weights = config['repo_weights']
+        self.commit_cap = self._cap(config['commit_cap'], 'commit_cap')
+        self.line_cap = self._cap(config['line_cap'], 'line_cap')
+
+    @staticmethod
+    def _number(value, name):
+        # json.load accepts Infinity and NaN, which would compile to SQL
+        # that names a column
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+            raise ValueError(f"{name} must be a non-negative number")
+        return value
+
+    @classmethod
+    def _cap(cls, value, name):
+        return None if value is None else int(cls._number(value, name))
+
+    def config(self):
+        return {
+            'status_points': dict(self.status_points),
+            'default_points': self.default_points,
+            'repo_weights': self.repo_weights,
+            'commit_cap': self.commit_cap,
+            'line_cap': self.line_cap,
+        }
+
+    def key(self):
+        return json.dumps(self.config(), sort_keys=True)
+
+    def points_sql(self, pr='pull_requests', repo='tracked_repos'):
+        cases = ' '.join(
+            f"WHEN {pr}.status = '{status}' THEN {points}" for status, points in sorted(self.status_points.items())
+        )
+        base = f"(CASE {cases} ELSE {self.default_points} END)" if cases else f"{self.default_points}"
+        if self.repo_weights:
+            base = f"{base} * COALESCE({repo}.weight, 1)"
+        # Rounded per PR, half up, so totals stay whole numbers
+        return f"CAST({base} + 0.5 AS INTEGER)"
+
+    def commits_sql(self, pr='pull_requests'):
+        if self.commit_cap is None:
+            return f"COALESCE({pr}.total_commits, 0)"
+        return f"MIN(COALESCE({pr}.total_commits, 0), {self.commit_cap})"
+
+    def lines_sql(self, pr='pull_requests'):
+        if self.line_cap is None:
+            return f"COALESCE({pr}.total_lines, 0)"
+        return f"MIN(COALESCE({pr}.total_lines, 0), {self.line_cap})"
+
+    def standings_query(self, users_where=None):
+        # Only the latest PR (highest pr_id) a user opened against a repo
+        # counts, so every user scores at most one PR per repo. users_where
+        # limits the query to some users and appears twice, so its
+        # parameters have to be passed twice as well.
+        latest_where = users_where and f"WHERE github_login IN (SELECT github_user FROM users WHERE {users_where})"
+        return f"""
+        WITH latest AS (
+            SELECT MAX(pr_id) AS pr_id
+            FROM pull_requests
+            {latest_where or ''}
+            GROUP BY repo_name, github_login
+        )
+        SELECT users.id AS user_id,
+               COUNT(pull_requests.pr_id) AS total_prs,
+               COALESCE(SUM({self.commits_sql()}), 0) AS total_commits,
+               COALESCE(SUM({self.lines_sql()}), 0) AS total_lines,
+               COALESCE(SUM(CASE
+                   WHEN pull_requests.pr_id IS NULL THEN 0
+                   ELSE {self.points_sql()}
+               END), 0) AS points
+        FROM users
+        LEFT JOIN pull_requests
+            ON pull_requests.github_login = users.github_user
+            AND pull_requests.pr_id IN (SELECT pr_id FROM latest)
+        LEFT JOIN tracked_repos ON tracked_repos.repo_name = pull_requests.repo_name
+        {f'WHERE {users_where}' if users_where else ''}
+        GROUP BY users.id
+        """
+
+
+def load_rules(path=SCORING_PATH):
+    if not os.path.exists(path):
+        return ScoringRules()
+    with open(path, 'r') as f:
+        return ScoringRules(json.load(f))
+
+
+class RulesFile:
+    # The active rules, re-read when scoring.json's mtime changes. A file
+    # that fails to load keeps the previous rules in force until it changes
+    # again.
+
+    def __init__(self, path=SCORING_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._rules = ScoringRules()
+
+    def current(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return self._rules
+
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    self._rules = load_rules(self.path)
+                    logging.info(f"Loaded scoring rules: {self._rules.key()}")
+                except Exception as e:
+                    logging.error(f"Keeping previous scoring rules, {self.path} is invalid: {str(e)}")
+                self._mtime = mtime
+        return self._rules
+
+
+rules = RulesFile()
@@ -0,0 +1,200 @@
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from flask import Blueprint, Flask, current_app, jsonify, request
+from flask_cors import CORS
+
+import db
+from configs.globals import (
+    LOG_LEVEL, STREAM_HEARTBEAT, STREAM_HISTORY, STREAM_MAX_CLIENTS, STREAM_POLL_INTERVAL, STREAM_QUEUE_SIZE,
+)
+from leaderboard import RANKED_QUERY, get_leaderboard_version
+
+logging.basicConfig(level=LOG_LEVEL)
+
+HEARTBEAT = b": heartbeat\n\n"
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def _event(name, version, payload):
+    data = json.dumps(payload, separators=(',', ':'))
+    return f"id: {version}\nevent: {name}\ndata: {data}\n\n".encode('utf-8')
+
+
+class Subscription:
+    def __init__(self, backlog):
+        self.queue = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.backlog = backlog
+        self.closed = False
+
+
+class LeaderboardBroadcaster:
+    # One thread per process watches the leaderboard version in app_state,
+    # which moves for webhook deltas, cron recomputes and bumps made by
+    # other processes alike. On a change it ranks the table once, diffs it
+    # against the previous standings and hands the same serialized event
+    # to every subscriber's queue.
+
+    def __init__(self, poll_interval=STREAM_POLL_INTERVAL, history=STREAM_HISTORY, max_clients=STREAM_MAX_CLIENTS):
+        self.poll_interval = poll_interval
+        # Lowered by gunicorn.conf.py when each client pins a worker thread
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        # (from_version, to_version, event) for resuming clients
+        self._history = deque(maxlen=history)
+        self._rows = None
+        self._version = None
+        self._published = None
+        self._snapshot = (None, None)
+        self._thread = None
+
+    def _standings(self, client):
+        rows = client.execute(RANKED_QUERY).fetchall()
+        return {
+            row[0]: {'github_user': row[0], 'name': row[1], 'total_prs': row[2], 'points': row[3], 'rank': row[4]}
+            for row in rows
+        }
+
+    def _refresh(self):
+        with db.pool.connection() as client:
+            version = get_leaderboard_version(client)
+            if version == self._version:
+                return
+            rows = self._standings(client)
+
+        with self._lock:
+            if self._rows is None:
+                self._rows, self._version, self._published = rows, version, version
+                return
+            # A concurrent refresh may already have applied a newer version
+            if version <= self._version:
+                return
+
+            changed = [row for login, row in rows.items() if self._rows.get(login) != row]
+            removed = [login for login in self._rows if login not in rows]
+            self._rows = rows
+            self._version = version
+            # Bumps that leave the standings as they were (e.g. a profile
+            # edit) move the version without producing an event
+            if not changed and not removed:
+                return
+
+            event = _event('delta', version, {
+                'version': version, 'since': self._published, 'changed': changed, 'removed': removed,
+            })
+            self._history.append((self._published, version, event))
+            self._published = version
+
+            for subscription in list(self._subscribers):
+                try:
+                    subscription.queue.put_nowait(event)
+                except queue.Full:
+                    # A client this far behind reconnects and resumes instead
+                    subscription.closed = True
+                    self._subscribers.discard(subscription)
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._refresh()
+            except Exception as e:
+                logging.error(f"Failed to refresh leaderboard stream: {str(e)}")
+
+    def _start(self):
+        # Started lazily so forked web workers each run their own poller
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='leaderboard-stream', daemon=True)
+            self._thread.start()
+
+    def _snapshot_event(self):
+        # Serialized once per version however many clients connect
+        if self._snapshot[0] != self._version:
+            self._snapshot = (self._version, _event('snapshot', self._version, {
+                'version': self._version,
+                'leaderboard': sorted(self._rows.values(), key=lambda row: (row['rank'], row['github_user'])),
+            }))
+        return self._snapshot[1]
+
+    def _backlog(self, since):
+        # Between two published events the standings do not change, so any
+        # version a client saw can be resumed from the first event after it.
+        if since is None or since > self._version:
+            return [self._snapshot_event()]
+        missed = [entry for entry in self._history if entry[1] > since]
+        if not missed:
+            return []
+        if missed[0][0] > since:
+            return [self._snapshot_event()]
+        return [event for _, _, event in missed]
+
+    def subscribe(self, since=None):
+        if self._rows is None:
+            self._refresh()
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                raise TooManySubscribers(f"Stream is at its limit of {self.max_clients} clients.")
+            self._start()
+            subscription = Subscription(self._backlog(since))
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def events(self, subscription):
+        try:
+            yield b"retry: 3000\n\n"
+            for event in subscription.backlog:
+                yield event
+            while not subscription.closed:
+                try:
+                    yield subscription.queue.get(timeout=STREAM_HEARTBEAT)
+                except queue.Empty:
+                    yield HEARTBEAT
+        finally:
+            self.unsubscribe(subscription)
+
+
+broadcaster = LeaderboardBroadcaster()
+
+
+stream_routes = Blueprint('stream', __name__)
+
+@stream_routes.route('/leaderboard/stream')
+def leaderboard_stream():
+    # Resumes from ?since= or the Last-Event-ID an EventSource sends on reconnect
+    since = request.args.get('since') or request.headers.get('Last-Event-ID')
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return jsonify({'error': 'Invalid version'}), 400
+
+    try:
+        subscription = broadcaster.subscribe(since)
+    except TooManySubscribers as e:
+        return jsonify({'error': f"{e}"}), 503
+
+    return current_app.response_class(
+        broadcaster.events(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def create_stream_app():
+    # Only /leaderboard/stream, for gunicorn.stream.conf.py's gevent
+    # process. The web app runs the migrations; this one only reads.
+    app = Flask(__name__)
+    CORS(app, supports_credentials=True)
+    app.register_blueprint(stream_routes)
+    return app
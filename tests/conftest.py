@@ -0,0 +1,26 @@
+import pytest
+
+import db
+import github
+from fake_github import FakeGitHub
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # A migrated database of its own for each test, behind the shared pool
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'app.db'))
+    db.pool.close_all()
+    with db.pool.connection() as client:
+        db.setup_database(client)
+        yield client
+    db.pool.close_all()
+
+
+@pytest.fixture
+def fake_github(monkeypatch):
+    fake = FakeGitHub({}).start()
+    monkeypatch.setattr(github, 'GITHUB_API_URL', fake.url)
+    monkeypatch.setattr(github, 'CRON_TOKEN', 'test-token')
+    github.token_pool._state.clear()
+    yield fake
+    fake.stop()
@@ -0,0 +1,81 @@
+import time
+
+import github
+import utils
+
+REPO = 'org/repo'
+# GitHub's default page size for the listing, as used by iter_pr_pages
+PER_PAGE = 100
+
+
+def make_prs(count, login='alice'):
+    base = 1767225600  # 2026-01-01T00:00:00Z
+    return [
+        {
+            'id': 1000 + number,
+            'number': number,
+            'state': 'open',
+            'user': {'login': login},
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(base + number * 60)),
+            '_details': {'commits': 2, 'additions': 10, 'deletions': 3, 'state': 'open', 'merged': False},
+        }
+        for number in range(1, count + 1)
+    ]
+
+
+def listings(fake):
+    return [entry for entry in fake.log if entry[0].startswith(f'/repos/{REPO}/pulls?')]
+
+
+def details(fake):
+    return [entry for entry in fake.log if entry[0].startswith(f'/repos/{REPO}/pulls/')]
+
+
+def test_fetch_filtered_prs_against_fake_github(client, fake_github):
+    client.execute("INSERT INTO users (github_user, name) VALUES ('alice', 'Alice')")
+    client.commit()
+    prs = make_prs(PER_PAGE * 2 + 50)
+    fake_github.prs_by_repo = {REPO: prs}
+
+    # First sync follows every Link: next page and stores every PR
+    assert utils.fetch_filtered_prs(client, [REPO]) == len(prs)
+    assert len(listings(fake_github)) == 3
+    assert len(details(fake_github)) == len(prs)
+    assert client.execute("SELECT COUNT(*) FROM pull_requests").fetchone()[0] == len(prs)
+
+    # Nothing changed: one listing page, stopped at the watermark, and the
+    # page itself revalidated as a 304
+    fake_github.log.clear()
+    assert utils.fetch_filtered_prs(client, [REPO]) == 0
+    assert [not_modified for _, not_modified in listings(fake_github)] == [True]
+    assert details(fake_github) == []
+
+    # Two PRs touched without changing their details: both are fetched
+    # again and their detail responses come back as 304 cache hits
+    for pr in prs[-2:]:
+        pr['updated_at'] = '2026-02-01T00:00:00Z'
+    fake_github.log.clear()
+    utils.fetch_filtered_prs(client, [REPO])
+    assert len(listings(fake_github)) == 1
+    assert sorted(details(fake_github)) == sorted(
+        (f'/repos/{REPO}/pulls/{pr["number"]}', True) for pr in prs[-2:]
+    )
+    assert client.execute(
+        "SELECT total_commits, total_lines FROM pull_requests WHERE pr_id = ?", (prs[-1]['id'],)
+    ).fetchone() == (2, 7)
+
+
+def test_http_cache_keeps_revalidated_entries(client, fake_github):
+    client.execute("INSERT INTO users (github_user, name) VALUES ('alice', 'Alice')")
+    client.commit()
+    fake_github.prs_by_repo = {REPO: make_prs(3)}
+    utils.fetch_filtered_prs(client, [REPO])
+    listing = client.execute("SELECT url FROM http_cache WHERE url LIKE '%/pulls?%'").fetchone()[0]
+
+    # Everything was last confirmed a month ago; a sync revalidates only the listing
+    client.execute("UPDATE http_cache SET fetched_at = ?", (time.time() - 30 * 24 * 3600,))
+    client.commit()
+    utils.fetch_filtered_prs(client, [REPO])
+
+    assert github.prune_http_cache(client) == 3
+    assert [row[0] for row in client.execute("SELECT url FROM http_cache")] == [listing]
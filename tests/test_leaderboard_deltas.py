@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+import db
+from allowlist import set_repo_config
+from leaderboard import find_leaderboard_drift, upsert_pull_requests
+
+REPOS = ['org/a', 'org/b', 'org/c']
+LOGINS = [f'user{i}' for i in range(8)]
+STATUSES = ['open', 'closed', 'merged']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_deltas_match_full_recompute(client, seed):
+    rng = random.Random(seed)
+    set_repo_config(client, 'org/b', weight=1.5)
+
+    # A PR's repo and author never change; everything else does
+    authors = {}
+    registered = set()
+    for step in range(300):
+        if rng.random() < 0.05:
+            login = rng.choice(LOGINS)
+            registered.add(login)
+            db.save_user_to_db(client, login, login.title(), None, None, None, None)
+            continue
+
+        records = []
+        for _ in range(rng.randint(1, 5)):
+            pr_id = rng.randint(1, 60)
+            repo, login = authors.setdefault(pr_id, (rng.choice(REPOS), rng.choice(LOGINS)))
+            records.append((
+                pr_id, repo, login, rng.randint(0, 10), rng.randint(-50, 200), rng.choice(STATUSES),
+                1767225600 + step * 3600,
+            ))
+        upsert_pull_requests(client, records)
+        client.commit()
+
+    assert registered
+    assert find_leaderboard_drift(client) == []
+    history = client.execute("""
+    SELECT leaderboard.user_id
+    FROM leaderboard
+    LEFT JOIN (
+        SELECT user_id, SUM(total_prs) AS total_prs, SUM(total_commits) AS total_commits,
+               SUM(total_lines) AS total_lines, SUM(points) AS points
+        FROM score_history
+        GROUP BY user_id
+    ) history ON history.user_id = leaderboard.user_id
+    WHERE COALESCE(history.total_prs, 0) != leaderboard.total_prs
+       OR COALESCE(history.total_commits, 0) != leaderboard.total_commits
+       OR COALESCE(history.total_lines, 0) != leaderboard.total_lines
+       OR COALESCE(history.points, 0) != leaderboard.points
+    """).fetchall()
+    assert history == []
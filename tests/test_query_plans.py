@@ -0,0 +1,12 @@
+import sqlite3
+
+import db
+
+
+def test_hot_queries_are_index_backed(tmp_path):
+    client = sqlite3.connect(tmp_path / 'app.db')
+    try:
+        db.migrate(client)
+        assert db.check_query_plans(client) == {}
+    finally:
+        client.close()
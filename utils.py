@@ -1,13 +1,18 @@
 import random
-import requests
 import logging
 from flask import redirect
-import datetime
+import calendar
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
-from configs.globals import CRON_TOKEN
+import db
+from allowlist import allowlist
+from configs.globals import INGEST_BATCH_SIZE, INGEST_WORKERS, LOG_LEVEL
+from github import STOP, ShuttingDown, cache_stats, cached_github_get, token_pool
+from leaderboard import upsert_pull_requests
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 
 
 def calculate_leaderboard(client):
@@ -26,203 +31,223 @@ def fetch_user_repos(username, client):
             client.execute("""
             SELECT repo_name 
             FROM pull_requests
-            WHERE github_user = ?""",(username,))
+            WHERE github_login = ?""",(username,))
         )
     except Exception as e:
          logging.error(f"Error updating leaderboard: {str(e)}")
 
-def update_leaderboard(client):
-    try:
-        cursor = client.cursor()
-
-        # Ensure all users exist in leaderboard (initialize with 0s)
-        cursor.execute("""
-        INSERT OR IGNORE INTO leaderboard (user_id, total_prs, total_commits, total_lines, points)
-        SELECT id, 0, 0, 0, 0 FROM users
-        """)
-
-        # Update leaderboard with filtered PRs and status points
-        cursor.execute("""
-        INSERT INTO leaderboard (user_id, total_prs, total_commits, total_lines, points)
-        SELECT users.id,
-       COUNT(DISTINCT pull_requests.repo_name), 
-       SUM(pull_requests.total_commits),
-       SUM(pull_requests.total_lines),
-       SUM(CASE WHEN pull_requests.status = 'merged' THEN 10 ELSE 5 END)
-        FROM users
-        JOIN pull_requests ON users.github_id = pull_requests.github_login
-        WHERE pull_requests.pr_id IN (
-            SELECT MAX(pr_id)
-            FROM pull_requests
-            GROUP BY repo_name, github_login
+# Marks the end of one repo's stream on the results queue
+_REPO_DONE = object()
+
+def fetch_filtered_prs(client, repos=None, max_workers=INGEST_WORKERS, batch_size=INGEST_BATCH_SIZE):
+    if repos is None:
+        repos = allowlist.repos()
+    registered = {row[0] for row in client.execute("SELECT github_user FROM users")}
+    # Pick up tokens saved by OAuth logins since the last cycle
+    token_pool.refresh()
+
+    # A watermark is only trusted while no one has registered since it was
+    # taken, otherwise PRs by the new user that predate it would be missed.
+    newest_user = client.execute("SELECT COALESCE(MAX(id), 0) FROM users").fetchone()[0]
+    watermarks = {
+        repo: last_updated_at
+        for repo, last_updated_at, users_seen in client.execute(
+            "SELECT repo_name, last_updated_at, users_seen FROM repo_sync_state"
         )
-        GROUP BY users.id
-
-
-        ON CONFLICT(user_id) DO UPDATE SET
-        total_prs = excluded.total_prs,
-        total_commits = excluded.total_commits,
-        total_lines = excluded.total_lines,
-        points = excluded.points;
-        """)
-
-        logging.debug("Leaderboard updated.")
-        client.commit()
-        cursor.close()
+        if users_seen == newest_user
+    }
 
+    # Bounded so a large first sync streams through instead of piling up in memory
+    results = queue.Queue(maxsize=batch_size * 2)
+    stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as detail_executor, \
+            ThreadPoolExecutor(max_workers=max(1, min(len(repos), max_workers))) as repo_executor:
+        for repo in repos:
+            repo_executor.submit(_scan_repo, repo, watermarks.get(repo), registered, detail_executor, results)
+
+        # Writes happen on this thread only, one transaction per batch
+        pending = len(repos)
+        batch = []
+        try:
+            while pending:
+                item = results.get()
+                if item[0] is not _REPO_DONE:
+                    # Once stopping, results are dropped; the repos are left
+                    # incomplete so the next cycle fetches them again
+                    if STOP.is_set():
+                        continue
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        _write_pr_batch(client, batch, stats)
+                        batch = []
+                    continue
+
+                # Everything the repo produced is queued ahead of its marker, so
+                # flushing here commits all of it before the watermark moves.
+                _, repo, newest, complete = item
+                pending -= 1
+                if STOP.is_set():
+                    batch = []
+                    continue
+                _write_pr_batch(client, batch, stats)
+                batch = []
+                if complete and newest:
+                    client.execute("""
+                    INSERT INTO repo_sync_state (repo_name, last_updated_at, users_seen) VALUES (?, ?, ?)
+                    ON CONFLICT(repo_name) DO UPDATE SET
+                    last_updated_at = excluded.last_updated_at,
+                    users_seen = excluded.users_seen
+                    """, (repo, newest, newest_user))
+                    client.commit()
+        except Exception:
+            # Repo threads may be blocked on the full queue; drain it so the
+            # executors can shut down, then surface the error.
+            while pending:
+                if results.get()[0] is _REPO_DONE:
+                    pending -= 1
+            raise
+
+    cache = cache_stats()
+    logging.info(
+        f"Synced PRs: {stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged. "
+        f"GitHub cache: {cache['hits']} hits, {cache['misses']} misses, {cache['bytes_saved']} bytes saved."
+    )
+    return stats['inserted'] + stats['updated']
+
+def _scan_repo(repo, since, registered, detail_executor, results):
+    newest = None
+    complete = True
+    try:
+        for page in iter_pr_pages(repo, since):
+            if STOP.is_set():
+                complete = False
+                break
+            if newest is None:
+                # Pages are sorted by updated_at descending
+                newest = page[0]['updated_at']
+
+            tracked = []
+            for pr in page:
+                github_login = (pr.get('user') or {}).get('login')
+                if not github_login:
+                    logging.warning(f"PR {pr['id']} missing user login. Skipping...")
+                elif github_login in registered:
+                    tracked.append(pr)
+
+            # Only PRs whose updated_at moved since the last sync need details
+            changed = _changed_prs(tracked)
+            futures = [(pr, detail_executor.submit(fetch_pr_details, repo, pr['number'])) for pr in changed]
+            for pr, future in futures:
+                try:
+                    pr_details = future.result()
+                except ShuttingDown:
+                    pr_details = None
+                except Exception as e:
+                    logging.error(f"Failed to fetch details for PR {pr['id']}: {str(e)}")
+                    pr_details = None
+                if not pr_details:
+                    logging.warning(f"Skipping PR {pr['id']} - Failed to fetch details.")
+                    complete = False
+                    continue
+                results.put((repo, pr, pr_details))
+
+    except ShuttingDown:
+        complete = False
     except Exception as e:
-        logging.error(f"Error updating leaderboard: {str(e)}")
-
-def load_filter_list():
-    with open('filter.txt', 'r') as f:
-        return [line.strip() for line in f if line.strip()]
-
-def fetch_filtered_prs(client):
-    repos = load_filter_list()
-    pr_count = 0
-    
-    for repo in repos:
-        prs = fetch_recent_prs(repo, client)
-        if not prs:
-            logging.info(f"No PRs found for {repo}. Skipping...")
-            continue
-
-        for pr in prs:
-            github_login = pr['user']['login'] if 'user' in pr else None
-            if not github_login:
-                logging.warning(f"PR {pr['id']} missing user login. Skipping...")
-                continue
-
-            pr_details = fetch_pr_details(repo, pr['id'], client)
-            if not pr_details:
-                logging.warning(f"Skipping PR {pr['id']} - Failed to fetch details.")
+        logging.error(f"Failed to list PRs for {repo}: {str(e)}")
+        complete = False
+    finally:
+        results.put((_REPO_DONE, repo, newest, complete))
+
+def _changed_prs(prs):
+    if not prs:
+        return []
+    placeholders = ','.join('?' * len(prs))
+    with db.pool.connection() as client:
+        known = dict(client.execute(
+            f"SELECT pr_id, updated_at FROM pr_sync_state WHERE pr_id IN ({placeholders})",
+            [pr['id'] for pr in prs]
+        ).fetchall())
+    return [pr for pr in prs if known.get(pr['id']) != pr.get('updated_at')]
+
+def _write_pr_batch(client, batch, stats):
+    if not batch:
+        return
+    try:
+        # Users can unregister between listing and writing; check once per batch
+        logins = list({pr['user']['login'] for _, pr, _ in batch})
+        placeholders = ','.join('?' * len(logins))
+        registered = {row[0] for row in client.execute(
+            f"SELECT github_user FROM users WHERE github_user IN ({placeholders})",
+            logins
+        )}
+
+        records = []
+        for repo, pr, pr_details in batch:
+            github_login = pr['user']['login']
+            if github_login not in registered:
+                logging.warning(f"User {github_login} not found. Skipping PR {pr['id']}.")
                 continue
-
             total_commits = pr_details.get('commits', 0)
             total_lines = pr_details.get('additions', 0) - pr_details.get('deletions', 0)
-            status = pr.get('state', 'open')
-
-            user_exists = client.execute(
-                "SELECT 1 FROM users WHERE github_id = ?",
-                (github_login,)
-            ).fetchone()
-
-            if not user_exists:
-                logging.warning(f"User {github_login} not found. Skipping PR {pr['id']}.")
-                continue
-
-            # Check for existing PR from the same repo and user
-            existing_pr = client.execute(
-                "SELECT pr_id FROM pull_requests WHERE pr_id = ?",
-                (pr['id'],)
-            ).fetchone()
-
-            if existing_pr:
-                logging.debug(f"Updating existing PR {existing_pr[0]}")
-                client.execute("""
-                UPDATE pull_requests
-                SET total_commits = ?, total_lines = ?, status = ?
-                WHERE pr_id = ?
-                """, (total_commits, total_lines, status, existing_pr[0]))
-            else:
-                logging.info(f"Inserting new PR {pr['id']}")
-                client.execute("""
-                INSERT INTO pull_requests (pr_id, repo_name, github_login, total_commits, total_lines, status)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """, (
-                    pr['id'],
-                    repo,
-                    github_login,
-                    total_commits,
-                    total_lines,
-                    status
-                ))
-                pr_count += 1
-
-    client.commit()
-    logging.info(f"Fetched {pr_count} new PRs.")
-    return pr_count
-
-def fetch_recent_prs(repo, client):
-    token = CRON_TOKEN
-    url = f"https://api.github.com/repos/{repo}/pulls?state=open"
-    headers = {
-        'Authorization': f'token {token}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
-
-    response = requests.get(url, headers=headers)
-
-    if response.status_code == 200:
-        return response.json()  
-    elif response.status_code == 403:
-        retry_after = response.headers.get('Retry-After')
-        if retry_after:
-            wait_time = int(retry_after)
-        else:
-            reset_time = int(response.headers.get('X-RateLimit-Reset', time.time()))
-            wait_time = max(reset_time - int(datetime.datetime.now().timestamp()), 60)
-        logging.warning(f"Rate limit hit. Sleeping for {wait_time} seconds...")
-        time.sleep(wait_time + 1)
-        return fetch_recent_prs(repo, client)
-
-
-
-def insert_pull_request(client, pr, repo):
-    github_login = pr['user']['login']
-    pr_details = fetch_pr_details(repo, pr['id'], client)
-    
-    if pr_details:
-        client.execute("""
-        INSERT INTO pull_requests (pr_id, repo_name, github_login, total_commits, total_lines)
-        VALUES (?, ?, ?, ?, ?)
-        """, (
-            pr['id'],
-            repo,
-            github_login,
-            pr_details['commits'],
-            pr_details['additions'] - pr_details['deletions']
-        ))
-        logging.info(f"Inserted PR {pr['id']} by {github_login} for {repo}")
-    else:
-        logging.warning(f"Skipping PR {pr['id']} due to missing details.")
-    
-    client.commit()
-
-def fetch_pr_details(repo, pr_id, client, token):
+            status = 'merged' if pr_details.get('merged') else pr_details.get('state', pr.get('state', 'open'))
+            records.append((pr['id'], repo, github_login, total_commits, total_lines, status, parse_github_time(pr.get('updated_at'))))
+
+        for key, count in upsert_pull_requests(client, records).items():
+            stats[key] += count
+        client.executemany("""
+        INSERT INTO pr_sync_state (pr_id, updated_at) VALUES (?, ?)
+        ON CONFLICT(pr_id) DO UPDATE SET updated_at = excluded.updated_at
+        """, [(pr['id'], pr.get('updated_at')) for _, pr, _ in batch])
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
 
-    # Fetch all open PRs and match the pr_id manually
-    url = f"https://api.github.com/repos/{repo}/pulls"
-    headers = {
-        'Authorization': f'token {token}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
-    
-    response = requests.get(url, headers=headers)
+def parse_github_time(value):
+    # GitHub timestamps are ISO 8601 in UTC, e.g. 2024-10-01T12:34:56Z
+    if not value:
+        return None
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%SZ'))
+
+def iter_pr_pages(repo, since=None, per_page=100):
+    # Follows Link: rel="next" newest-first and stops at the first PR that
+    # was last updated before `since`, so steady-state syncs read one page.
+    url = f"repos/{repo}/pulls"
+    params = {'state': 'all', 'sort': 'updated', 'direction': 'desc', 'per_page': per_page}
+
+    while url:
+        response = cached_github_get(url, params=params)
+        if response.status_code != 200:
+            raise Exception(f"Failed to fetch PRs for {repo}: {response.status_code}")
+
+        page = response.json()
+        if since:
+            fresh = [pr for pr in page if pr['updated_at'] >= since]
+            if fresh:
+                yield fresh
+            if len(fresh) < len(page):
+                return
+        elif page:
+            yield page
+
+        url = response.links.get('next', {}).get('url')
+        params = None  # the next link already carries the query string
+
+def fetch_pr_details(repo, number):
+    # Go straight to the PR's detail endpoint instead of re-listing the repo
+    response = cached_github_get(f"repos/{repo}/pulls/{number}")
 
     if response.status_code == 200:
-        pr_list = response.json()
-        
-        # Search for matching PR by ID
-        matched_pr = next((pr for pr in pr_list if pr['id'] == pr_id), None)
-        if not matched_pr:
-            logging.warning(f"PR {pr_id} not found in the open PR list for {repo}")
-            return None
-        
-        # Fetch detailed info using the pulls_url
-        detail_url = matched_pr['url']  # This is the correct URL for the PR
-        details_response = requests.get(detail_url, headers=headers)
-
-        if details_response.status_code == 200:
-            pr_details = details_response.json()
-            return {
-                'commits': pr_details['commits'],
-                'additions': pr_details['additions'],
-                'deletions': pr_details['deletions']
-            }
-        else:
-            logging.warning(f"Failed to fetch detailed PR data: {details_response.status_code}")
-            return None
+        pr_details = response.json()
+        return {
+            'commits': pr_details['commits'],
+            'additions': pr_details['additions'],
+            'deletions': pr_details['deletions'],
+            'state': pr_details.get('state', 'open'),
+            'merged': pr_details.get('merged', False)
+        }
     else:
-        logging.error(f"Failed to fetch open PRs for {repo}: {response.status_code}")
+        logging.warning(f"Failed to fetch detailed PR data for {repo}#{number}: {response.status_code}")
         return None
@@ -0,0 +1,141 @@
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+import db
+from configs.globals import (
+    LOG_LEVEL, WEBHOOK_BATCH_SIZE, WEBHOOK_DEBOUNCE, WEBHOOK_DELIVERY_TTL, WEBHOOK_POLL_INTERVAL, WEBHOOK_SECRET,
+)
+from leaderboard import upsert_pull_requests
+from scheduler import note_webhook_activity
+
+logging.basicConfig(level=LOG_LEVEL)
+
+# Pull request actions that can change a PR's commits, lines or status
+SUPPORTED_ACTIONS = {'opened', 'synchronize', 'closed'}
+
+_wakeup = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+if not WEBHOOK_SECRET:
+    logging.warning("WEBHOOK_SECRET is not set; webhook signatures are not verified.")
+
+
+def verify_signature(body, signature, secret=WEBHOOK_SECRET):
+    # X-Hub-Signature-256 is an HMAC of the raw body, so this runs before
+    # the payload is parsed and a forged request costs one hash
+    if not secret:
+        return True
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len('sha256='):])
+
+
+def enqueue_pr_event(client, pr_id, repo, github_login, total_commits, total_lines, status, delivery_id=None):
+    # Returns False for a delivery that was already queued (a GitHub retry
+    # or manual redelivery), which is acknowledged without doing anything.
+    now = time.time()
+    try:
+        if delivery_id:
+            inserted = client.execute(
+                "INSERT OR IGNORE INTO webhook_deliveries (delivery_id, received_at) VALUES (?, ?)",
+                (delivery_id, now)
+            ).rowcount
+            if not inserted:
+                client.rollback()
+                return False
+
+        client.execute("""
+        INSERT INTO webhook_outbox (pr_id, repo_name, github_login, total_commits, total_lines, status, received_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (pr_id, repo, github_login, total_commits, total_lines, status, now))
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
+    # Started lazily so forked web workers each get their own drainer
+    start_webhook_worker()
+    _wakeup.set()
+    return True
+
+
+def purge_webhook_deliveries(client, ttl=WEBHOOK_DELIVERY_TTL):
+    purged = client.execute(
+        "DELETE FROM webhook_deliveries WHERE received_at < ?",
+        (time.time() - ttl,)
+    ).rowcount
+    client.commit()
+    return purged
+
+
+def drain_webhook_outbox(client, batch_size=WEBHOOK_BATCH_SIZE):
+    # A plain read needs no lock, so idle wakeups in every web worker and
+    # the cron cycle don't queue up behind writers just to find nothing
+    if client.execute("SELECT 1 FROM webhook_outbox LIMIT 1").fetchone() is None:
+        return 0, 0
+
+    # BEGIN IMMEDIATE takes the write lock up front, so concurrent drainers
+    # (one per web worker) never apply the same rows twice.
+    client.execute("BEGIN IMMEDIATE")
+    try:
+        rows = client.execute("""
+        SELECT id, pr_id, repo_name, github_login, total_commits, total_lines, status, received_at
+        FROM webhook_outbox
+        ORDER BY id
+        LIMIT ?
+        """, (batch_size,)).fetchall()
+
+        if not rows:
+            client.rollback()
+            return 0, 0
+
+        # Several deliveries for one PR (e.g. synchronize after a force-push)
+        # collapse into the latest one
+        latest = {}
+        for row in rows:
+            latest[row[1]] = row
+
+        upsert_pull_requests(client, [row[1:] for row in latest.values()])
+        # Lets the cron scheduler skip polling repos webhooks keep current
+        note_webhook_activity(client, {row[2] for row in latest.values()})
+
+        client.execute("DELETE FROM webhook_outbox WHERE id <= ?", (rows[-1][0],))
+        client.commit()
+    except Exception:
+        client.rollback()
+        raise
+
+    logging.debug(f"Applied {len(rows)} webhook events as {len(latest)} PR updates.")
+    return len(rows), len(latest)
+
+
+def _run_worker():
+    purged_at = 0
+    while True:
+        _wakeup.wait(timeout=WEBHOOK_POLL_INTERVAL)
+        _wakeup.clear()
+        time.sleep(WEBHOOK_DEBOUNCE)
+        try:
+            with db.pool.connection() as client:
+                while drain_webhook_outbox(client)[0] == WEBHOOK_BATCH_SIZE:
+                    pass
+                # Expired delivery IDs are cleared about once an hour
+                if time.time() - purged_at > 3600:
+                    purge_webhook_deliveries(client)
+                    purged_at = time.time()
+        except Exception as e:
+            logging.error(f"Failed to drain webhook outbox: {str(e)}")
+
+
+def start_webhook_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run_worker, name='webhook-worker', daemon=True)
+            _worker.start()
+            _wakeup.set()  # pick up anything left over from a previous run
+    return _worker